@@ -213,19 +213,19 @@ echo "Finished primer picking."
 echo "Testing the primers for specificity and sensitivity in silico and determining the target"
 
 if [[ -n $OUT && $DEL -eq 0 && -n $REF ]]; then
-    "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD" -o "$OUT" -c "$DEL" -r "$REF" && true
+    "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD" -o "$OUT" -d "$DEL" -r "$REF" && true
     EXIT_STATUS="$?"
 elif [[ -n $OUT && -n $REF ]]; then
     "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD" -o "$OUT" -r "$REF"&& true
     EXIT_STATUS="$?"
 elif [[ -n $OUT && $DEL -eq 0 ]]; then
-    "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD" -o "$OUT" -c "$DEL" && true
+    "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD" -o "$OUT" -d "$DEL" && true
     EXIT_STATUS="$?"
 elif [[ -n $REF && $DEL -eq 0 ]]; then
-    "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD" -r "$REF" -c "$DEL" && true
+    "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD" -r "$REF" -d "$DEL" && true
     EXIT_STATUS="$?"
 elif [[ $DEL -eq 0 ]]; then
-    "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD"  -c "$DEL"&& true
+    "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD"  -d "$DEL"&& true
     EXIT_STATUS="$?"
 elif [[ -n $OUT ]]; then
     "$default_python"  "$SCRIPT_DIR"/Primer_Testing_module_optimized.py -f "$FOLD"  -o "$OUT"&& true
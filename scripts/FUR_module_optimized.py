@@ -81,7 +81,12 @@ def run_fur(option: str, outfile_prefix: str, source: Path, logger: Logger):
 
     fur_out.write_text(fur_output, encoding="utf-8" )
 
-    if not fur_out.exists() or fur_out.stat().st_size == 0:
+    # one stat tells both whether the file exists and whether it is empty
+    try:
+        fur_out_empty = fur_out.stat().st_size == 0
+    except FileNotFoundError:
+        fur_out_empty = True
+    if fur_out_empty:
         logger.error(f"Fur could not find unique regions or did not run successfully. {fur_out} is empty or does not exist.")
         sys.exit()
 
@@ -291,8 +291,12 @@ def main():
     resultp3 = resultf2p.with_suffix(".primer3_out.txt")
     resultp3.write_text(primer3.stdout.strip(), encoding="utf-8")
 
-    # complain about no results and raise exception
-    if not resultp3.exists() or resultp3.stat().st_size == 0:
+    # complain about no results and raise exception. One stat tells both whether the file exists and whether it is empty
+    try:
+        resultp3_empty = resultp3.stat().st_size == 0
+    except FileNotFoundError:
+        resultp3_empty = True
+    if resultp3_empty:
         logger.error(
             "Primer3 did not manage to generate primers or did not run successfully. {resultp3} does not exist or is empty.",
             exc_info=1,
@@ -2,15 +2,33 @@
 
 import os
 import sys
+import errno
 import argparse
 import subprocess
 import shutil
+import tempfile
+import hashlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
 from pathlib import Path
 import re
-from Bio import SeqIO  # type: ignore
 from logging_handler import Logger
 
+# trailing primer/target number in file names, e.g. "..._Target_3.txt"
+_TRAIL_NUM_RE = re.compile(r"_(\d+)\.txt")
+# headers of the primer and probe sequences in the Primer3 module output
+_PRIMER_KEY_RE = re.compile(rb"PRIMER_(?:LEFT|RIGHT|INTERNAL)")
+# file endings of assemblies
+_FASTA_SUFFIXES = frozenset({".fasta", ".fa", ".fna"})
+# NCBI throttles more than ~3 concurrent remote blast requests
+_BLASTX_WORKERS = 3
+# targets per remote blastx request
+_BLASTX_BATCH_SIZE = 10
+# ending of the blastx result file written next to each target
+_BLASTX_SUFFIX = "_blastx_1e-5.txt"
+# seqkit is looked up on the PATH once, not on every launch
+_SEQKIT = shutil.which("seqkit") or "seqkit"
+
 
 def check_folders(*folders: Path,logger: Logger):
     """
@@ -44,6 +62,21 @@ def check_program_installed(program: str):
     # which is a tool in shutil.
     return shutil.which(program) is not None
 
+def list_files(folder: Path) -> list:
+    """
+    List the files in a folder, without subfolders.
+
+    Args:
+        folder (Path): path object of the folder
+
+    Returns:
+        list: sorted path objects of the files. scandir knows the file type from the directory listing,
+              so no file is stat'ed for it.
+    """
+    with os.scandir(folder) as entries:
+        return sorted(Path(entry.path) for entry in entries if entry.is_file())
+
+
 def extract_primer_sequences(file: Path, logger: Logger) -> tuple[str, str, str]:
     """
     Extract primer sequences from a file.
@@ -58,13 +91,19 @@ def extract_primer_sequences(file: Path, logger: Logger) -> tuple[str, str, str]
     # initialize empty dictionary
     sequences = {"PRIMER_LEFT": None, "PRIMER_RIGHT": None, "PRIMER_INTERNAL": None}
 
-    # if you find a line with the keys from sequences, then add the next line as a value to the key in this dictionary
-    with file.open("r") as f:
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-            for key in sequences.keys():
-                if key in line:
-                    sequences[key] = lines[i + 1].strip()
+    # if you find a line with the keys from sequences, then add the next line as a value to the key in this dictionary.
+    # The file is streamed and only read until all three sequences are found. Primer files are ASCII,
+    # so they are read as bytes and only the sequences are decoded
+    missing = {key.encode(): key for key in sequences}
+    with file.open("rb") as f:
+        lines = iter(f)
+        for line in lines:
+            # one regex search per line instead of a substring test per key
+            match = _PRIMER_KEY_RE.search(line)
+            if match and match.group() in missing:
+                sequences[missing.pop(match.group())] = next(lines, b"").strip().decode()
+                if not missing:
+                    break
 
     # did not find all keys (not all values in dictionary are truthy)? Throw error!
     if not all(sequences.values()):
@@ -79,6 +118,38 @@ def extract_primer_sequences(file: Path, logger: Logger) -> tuple[str, str, str]
     )
 
 
+def copy_file_content(readfile, outfile):
+    """
+    Append the content of one open file to another.
+
+    Args:
+        readfile: file object opened for reading in binary mode
+        outfile: file object opened for writing in binary mode
+
+    Returns:
+        None
+    """
+    start = offset = None
+    try:
+        # the kernel copies the data, it never passes through python
+        in_fd = readfile.fileno()
+        out_fd = outfile.fileno()
+        outfile.flush()
+        start = offset = readfile.tell()
+        size = os.fstat(in_fd).st_size
+        while offset < size:
+            sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except (AttributeError, OSError, ValueError):
+        # only fall back if nothing was sent yet, otherwise data would be duplicated
+        if offset != start:
+            raise
+        # no sendfile on this platform/ file type. Copy in 4 MiB blocks instead of the default 64 KiB
+        shutil.copyfileobj(readfile, outfile, length=4 * 1024 * 1024)
+
+
 def concat_files(folder: Path, name: str, source: Path, logger: Logger) -> str:
     """
     Concatenate the content of all files found in a folder.
@@ -89,7 +160,7 @@ def concat_files(folder: Path, name: str, source: Path, logger: Logger) -> str:
         source (Path): Path object to the folder that rules it all (the results folder of this DiPPER2 run)
 
     Returns:
-        the filename of the concatenated fasta file
+        the filename of the concatenated fasta file. If it already exists and is newer than the folder and all files in it, it is not written again.
 
     Raises:
         FileNotFoundError: If no files were found or no data was written to the output file.
@@ -97,61 +168,106 @@ def concat_files(folder: Path, name: str, source: Path, logger: Logger) -> str:
     # Create output file path
     outfilename = source / f"{name}_concatenated.fasta"
 
+    # Reuse the concatenated file of an earlier run if nothing in the folder changed since.
+    # The folder itself is checked too, its mtime changes when files are added or removed
+    try:
+        out_stat = outfilename.stat()
+        src_mtime = max(
+            (entry.stat().st_mtime for entry in os.scandir(folder)),
+            default=0,
+        )
+        src_mtime = max(src_mtime, folder.stat().st_mtime)
+        if out_stat.st_size > 0 and out_stat.st_mtime >= src_mtime:
+            logger.info(f"{outfilename} is up to date, not concatenating {folder} again.")
+            return outfilename
+    except FileNotFoundError:
+        pass
+
     # Flag to track if any file was processed (not the most elegant way, but here we are)
     files_written = 0
 
-    # Open the output file in binary mode, write the contents of all other files to concat file
-    with open(outfilename, "wb") as outfile:
-        try:
-            for filename in folder.glob("*"):
-                if filename.name == outfilename.name:  # Skip the output file
-                    continue
-                with filename.open("rb") as readfile:
-                    shutil.copyfileobj(readfile, outfile)
-                    files_written += 1
-        except FileNotFoundError as e:
+    # Write to a temporary file next to the output and only rename it when the concatenation is complete.
+    # A failed run never leaves a truncated file behind that a later run would reuse as up to date
+    tmp_file = tempfile.NamedTemporaryFile("wb", dir=source, prefix=f".{outfilename.name}.", delete=False)
+    tmp_path = Path(tmp_file.name)
+    try:
+        # Write the contents of all other files to the concat file. Sorted, so the concatenation is the same on every run
+        with tmp_file as outfile:
+            try:
+                for filename in sorted(folder.glob("*")):
+                    if filename in (outfilename, tmp_path):  # Skip the output file
+                        continue
+                    with filename.open("rb") as readfile:
+                        copy_file_content(readfile, outfile)
+                        files_written += 1
+            except FileNotFoundError as e:
+                logger.exception(
+                    f"Could not open or read files in {folder}. Concatenation failed.",
+                    exc_info=1,
+                )
+                raise FileNotFoundError(
+                    f"Could not open or read files in {folder}. Concatenation failed: {e}"
+                ) from e
+
+        # Raise an exception if no files were processed
+        if files_written == 0:
             logger.exception(
-                f"Could not open or read files in {folder}. Concatenation failed.",
-                exc_info=1,
-            )
-            raise FileNotFoundError(
-                f"Could not open or read files in {folder}. Concatenation failed: {e}"
-            ) from e
+                    f"Could not open or read files in {folder}. Concatenation failed.",
+                    exc_info=1,
+                )
+            raise FileNotFoundError(f"No files found to concatenate in folder: {folder}")
 
-    # Raise an exception if no files were processed
-    if files_written == 0:
-        logger.exception(
-                f"Could not open or read files in {folder}. Concatenation failed.",
-                exc_info=1,
-            )
-        raise FileNotFoundError(f"No files found to concatenate in folder: {folder}")
+        os.replace(tmp_path, outfilename)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
 
     return outfilename
 
+def write_primer_table(primer_pairs: dict, table: Path) -> Path:
+    """
+    Write the primer pairs into a tab-separated primer file for 'seqkit amplicon -p'.
+
+    Args:
+        primer_pairs (dict): maps (forward, reverse) primer tuples to the list of primer files containing them
+        table (Path): the primer file to write
+
+    Returns:
+        Path: the written primer file. Each pair is named after its first primer file.
+    """
+    with open(table, "w", encoding="utf-8") as out_file:
+        for (frwd, rev), files in primer_pairs.items():
+            out_file.write(f"{files[0].name}\t{frwd}\t{rev}\n")
+    return table
+
+
 def run_seqkit_amplicon_with_optional_timeout(
-    frwd: str, rev: str, concat: str, number: int, logger: Logger, timeout: int = None
-):
+    primer_table: Path, concat: str, number: int, out_paths: dict, logger: Logger, timeout: int = None, threads: int = None
+) -> set:
     """
-    Run seqkit amplicon with an optional timeout and return the output.
+    Run seqkit amplicon for all primer pairs at once with an optional timeout and split its output into one file per primer pair.
 
     Args:
-        frwd (str): The forward primer sequence.
-        rev (str): The reverse primer sequence.
+        primer_table (Path): Tab-separated primer file (name, forward primer, reverse primer), see write_primer_table.
         concat (str): Path to the concatenated file.
         number (int): The number of allowed mismatches.
+        out_paths (dict): Maps the primer names in the primer file to the file the bed lines of that primer pair are written to.
+                          Files are only created for primer pairs with amplicons.
         timeout (Optional[int]): Timeout in seconds for the subprocess. If None, no timeout is applied.
+        threads (Optional[int]): Threads seqkit uses for the mismatch search. If None, all CPUs are used.
+                                 Without mismatches seqkit runs with its default.
 
     Returns:
-        Optional[str]: Output of seqkit amplicon as a string if successful, None if it times out.
+        set: The names of the primer pairs seqkit amplicon found amplicons for. Empty if it found none, None if it timed out.
 
     Raises:
         ValueError: If invalid arguments are provided.
         subprocess.CalledProcessError: If seqkit amplicon fails with a non-zero exit code.
     """
     # Validate inputs
-    if not all([frwd, rev, concat]):
+    if not all([primer_table, concat, out_paths]):
         raise ValueError(
-            "Forward primer, reverse primer, and concatenated file must be provided."
+            "Primer file, output files, and concatenated file must be provided."
         )
     # sense check mismatch number 
     if number < 0:
@@ -161,53 +277,61 @@ def run_seqkit_amplicon_with_optional_timeout(
         raise ValueError("Mismatch number must be a non-negative integer.")
 
     logger.info(
-        f"Running seqkit amplicon on {concat} with primers {frwd} (forward) and {rev} (reverse)."
+        f"Running seqkit amplicon on {concat} with the primers in {primer_table}."
     )
 
-    try:
-        # Step 1: Create subprocess to read the input file using 'cat'
-        cat = subprocess.Popen(
-            ["cat", concat],
-            stdout=subprocess.PIPE,  # Send output to the next process
-            text=True,  # Enable text mode for I/O
-        )
-        logger.debug(f"'cat {concat}' subprocess started successfully.")
+    # seqkit writes all bed lines of this run into one file, named after the primer file, the fasta and the
+    # mismatch level, so parallel runs do not collide
+    bed_path = primer_table.with_name(f"{primer_table.stem}_{Path(concat).stem}_m{number}.bed")
 
-        # Step 2: Pipe the output of 'cat' into 'seqkit amplicon'
-        logger.debug("'seqkit amplicon' subprocess started successfully.")
-        seqkit_out = subprocess.Popen(
-            ["seqkit", "amplicon", "-F", frwd, "-R", rev, "--bed", "-m", str(number)],
-            stdin=cat.stdout,  # Input from 'cat' command
-            stdout=subprocess.PIPE,  # Capture standard output
+    try:
+        # seqkit reads the concatenated fasta itself, no need to pipe it through 'cat'.
+        # Its output goes straight into the bed file, it never passes through python.
+        # The process is used as context manager, so its pipes are closed and it is
+        # waited for on every exit path (no leaked fds or zombies).
+        cmd = [_SEQKIT, "amplicon", "-p", str(primer_table), "--bed", "-m", str(number)]
+        # only the mismatch search profits from more threads. GOMAXPROCS keeps the go runtime
+        # itself to the same number of threads, so parallel runs do not oversubscribe the CPUs
+        env = None
+        if number > 0:
+            jobs = str(threads or available_cpus())
+            cmd += ["-j", jobs]
+            env = {**os.environ, "GOMAXPROCS": jobs}
+        cmd.append(str(concat))
+        with open(bed_path, "wb") as bed_file, subprocess.Popen(
+            cmd,
+            stdout=bed_file,  # write directly to the bed file
             stderr=subprocess.PIPE,  # Capture standard error
-            text=True,  # Enable text mode for I/O
-        )
-
-        # Step 3: Handle timeout if provided
-        if timeout is not None:
-            output, error = seqkit_out.communicate(timeout=timeout)
-        else:
-            output, error = seqkit_out.communicate()
+            close_fds=False,  # lets Popen use posix_spawn, our fds are not inheritable anyway
+            env=env,
+        ) as seqkit_out:
+            logger.debug("'seqkit amplicon' subprocess started successfully.")
 
-        # Step 4: Check for errors
+            # Handle timeout if provided (None means no timeout)
+            try:
+                _, error = seqkit_out.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                seqkit_out.kill()
+                seqkit_out.communicate()
+                logger.warning(f"Seqkit amplicon timed out after {timeout} seconds.")
+                return None
+
+        # Check for errors
         if seqkit_out.returncode != 0:
-            logger.error(f"Seqkit error output: {error.strip()}")
+            error = error.decode(errors="replace").strip()
+            logger.error(f"Seqkit error output: {error}")
             raise subprocess.CalledProcessError(
-                seqkit_out.returncode, "seqkit amplicon", output=error.strip()
+                seqkit_out.returncode, "seqkit amplicon", output=error
             )
 
+        output_size = bed_path.stat().st_size
         logger.info(
-            f"Seqkit amplicon ran successfully. Output size: {len(output)} characters."
+            f"Seqkit amplicon ran successfully. Output size: {output_size} characters."
         )
-        return output
-
-    except subprocess.TimeoutExpired:
-        # Handle timeout scenarios
-        logger.warning(f"Seqkit amplicon timed out after {timeout} seconds.")
-        seqkit_out.kill()  # Ensure seqkit process is terminated
-        if cat:
-            cat.kill()  # Ensure 'cat' process is terminated
-        return None
+        # no amplicons, no files
+        if output_size == 0:
+            return set()
+        return split_bed_by_primer(bed_path, out_paths)
 
     except subprocess.CalledProcessError as e:
         # Handle non-zero exit codes from seqkit
@@ -224,11 +348,184 @@ def run_seqkit_amplicon_with_optional_timeout(
         raise Exception(f"An unexpected error occurred: {str(e)}") from e
 
     finally:
-        # Cleanup: Ensure all subprocesses are terminated
-        if cat and cat.poll() is None:
-            cat.terminate()
-        if seqkit_out and seqkit_out.poll() is None:
-            seqkit_out.terminate()
+        bed_path.unlink(missing_ok=True)
+
+
+def split_bed_by_primer(bed_path: Path, out_paths: dict) -> set:
+    """
+    Split the bed output of a multi-primer seqkit amplicon run into one file per primer pair.
+
+    Args:
+        bed_path (Path): the bed file written by seqkit amplicon. The 4th column is the primer name.
+        out_paths (dict): Maps the primer names to the file their bed lines are written to.
+
+    Returns:
+        set: The names of the primer pairs with bed lines. Only their files are created.
+    """
+    if len(out_paths) == 1:
+        # only one primer pair, the bed file already is its result
+        (name, out_path), = out_paths.items()
+        shutil.move(bed_path, out_path)
+        return {name}
+
+    out_files = {}
+    try:
+        with open(bed_path, "rb") as bed_file:
+            for line in bed_file:
+                name = line.split(b"\t", 4)[3]
+                out_file = out_files.get(name)
+                if out_file is None:
+                    out_file = out_files[name] = open(out_paths[name.decode()], "wb")
+                out_file.write(line)
+    finally:
+        for out_file in out_files.values():
+            out_file.close()
+    return {name.decode() for name in out_files}
+
+
+def collect_amplicon_result(future, kind: str, number: int, out_paths: dict, logger: Logger) -> set:
+    """
+    Wait for a seqkit amplicon job and report primer pairs without amplicons.
+
+    Args:
+        future (Future): the job running run_seqkit_amplicon_with_optional_timeout
+        kind (str): target or neighbour
+        number (int): the number of allowed mismatches of the job
+        out_paths (dict): the result files of the job, by primer name
+
+    Returns:
+        set: The names of the primer pairs the job found amplicons for. None if the job timed out.
+
+    Raises:
+        subprocess.CalledProcessError, OSError, RuntimeError: If the job failed.
+    """
+    try:
+        found = future.result()
+    except subprocess.CalledProcessError as e:
+        logger.exception(f"Error running seqkit amplicon: {e}")
+        raise subprocess.CalledProcessError(
+            returncode=-1, cmd="seqkit amplicon", output="", stderr=str(e)
+        ) from e
+    except OSError as e:
+        logger.exception(
+            f"Error with the operating system while running seqkit amplicon: {e}"
+        )
+        raise OSError(
+            f"Error with the operating system while running seqkit amplicon: {e}"
+        ) from e
+    except Exception as e:
+        logger.exception(
+            f"Unknown exception/ unexpected error running seqkit amplicon: {e}"
+        )
+        raise RuntimeError(
+            f"Unknown exception/ unexpected error running seqkit amplicon: {e}"
+        ) from e
+    logger.info(f"ran seqkit amplicon against the {kind}s for {number} mismatches")
+
+    for name in out_paths.keys() - (found or set()):
+        logger.warning(
+            f"Seqkit amplicon did not return any matches for the primers in {name} in the {kind}s with -m flag at {number}"
+        )
+    return found
+
+
+def count_mismatches(primer: bytes, site: bytes) -> int:
+    """
+    Count the mismatches between a primer and the site it binds to.
+
+    Args:
+        primer (bytes): the primer sequence
+        site (bytes): the sequence of the binding site, as long as the primer
+
+    Returns:
+        int: number of positions that differ
+    """
+    return sum(p != b for p, b in zip(primer, site))
+
+
+# complement of bases, for the reverse primer
+_COMPLEMENT = bytes.maketrans(b"ACGTN", b"TGCAN")
+
+
+def split_bed_by_mismatches(bed_path: Path, frwd: str, rev: str, out_paths: dict) -> set:
+    """
+    Split the seqkit amplicon output of the highest mismatch level into the lower levels.
+
+    The mismatches are counted between the primers and the ends of the amplicon (column 7, which seqkit reports
+    starting with the forward primer). Newer seqkit releases can report them with -M/--output-mismatches, counting
+    them here keeps the module working with any seqkit whose amplicon command has -p and --bed.
+    seqkit reports every forward binding site together with every reverse binding site downstream of it, so the
+    amplicons with at most i mismatches in each primer are exactly those a separate run with -m i finds.
+
+    Args:
+        bed_path (Path): bed file of seqkit amplicon with the most mismatches
+        frwd (str): the forward primer
+        rev (str): the reverse primer
+        out_paths (dict): Maps mismatch levels (int) to the file the bed lines with at most that many mismatches
+                          in each primer are written to.
+
+    Returns:
+        set: The mismatch levels with bed lines. Only their files are created.
+    """
+    frwd = frwd.upper().encode()
+    # the amplicon ends with the reverse complement of the reverse primer
+    rev_site = rev.upper().encode().translate(_COMPLEMENT)[::-1]
+
+    out_files = {}
+    try:
+        with open(bed_path, "rb") as bed_file:
+            for line in bed_file:
+                amplicon = line.rstrip(b"\r\n").split(b"\t", 7)[6].upper()
+                mismatches = max(
+                    count_mismatches(frwd, amplicon[:len(frwd)]),
+                    count_mismatches(rev_site, amplicon[-len(rev_site):]),
+                )
+                for level, out_path in out_paths.items():
+                    if mismatches <= level:
+                        out_file = out_files.get(level)
+                        if out_file is None:
+                            out_file = out_files[level] = open(out_path, "wb")
+                        out_file.write(line)
+    finally:
+        for out_file in out_files.values():
+            out_file.close()
+    return set(out_files)
+
+
+def available_cpus() -> int:
+    """
+    Get the number of CPUs this process is allowed to run on.
+
+    Returns:
+        int: number of usable CPUs. Respects the CPU affinity (e.g. taskset, SLURM, containers)
+             where the platform supports it, otherwise all CPUs of the machine.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # no sched_getaffinity on macOS
+        return os.cpu_count() or 1
+
+
+def get_max_workers(n_jobs: int, fasta_size: int) -> int:
+    """
+    Get the number of seqkit amplicon jobs that can run at the same time.
+
+    Args:
+        n_jobs (int): number of jobs
+        fasta_size (int): size in bytes of the largest fasta the jobs read
+
+    Returns:
+        int: number of workers, at least 1. Capped by the number of CPUs and by the free memory,
+             so that every worker has about twice the size of the fasta available.
+    """
+    workers = min(n_jobs, available_cpus())
+    try:
+        free_ram = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        # not available on this platform, only cap by CPUs
+        return max(1, workers)
+    return max(1, min(workers, free_ram // max(1, 2 * fasta_size)))
 
 
 def move_files_with_pattern(source_dir: Path, pattern: str, destination_dir: Path):
@@ -246,11 +543,20 @@ def move_files_with_pattern(source_dir: Path, pattern: str, destination_dir: Pat
     # create destination folder unless it already exists, do not raise FileExistsError
     destination_dir.mkdir(exist_ok=True)
 
-    # iterate through the directory, move files that have a certain pattern in their name
-    for file in source_dir.iterdir():
-        if pattern in file.name and file.is_file():
-            destination_file = destination_dir / file.name
-            shutil.move(str(file), str(destination_file))
+    # iterate through the directory, move files that have a certain pattern in their name.
+    # scandir entries carry the file type from readdir, and a rename is a single syscall
+    # as long as source and destination share a filesystem (they do here).
+    with os.scandir(source_dir) as entries:
+        for entry in entries:
+            if pattern in entry.name and entry.is_file():
+                destination_file = destination_dir / entry.name
+                try:
+                    os.rename(entry.path, destination_file)
+                except OSError as e:
+                    # only fall back to copy & delete if the destination is on another device
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(entry.path, str(destination_file))
 
 
 def run_seqkit_locate(amplicon: str, ref_file: Path,logger: Logger):
@@ -261,7 +567,7 @@ def run_seqkit_locate(amplicon: str, ref_file: Path,logger: Logger):
         ref_file (Path): path object of file used as reference
 
     Returns:
-        seqkit locate output in bed format
+        seqkit locate output in bed format (bytes)
 
     Raises:
         subprocess.CalledProcessError
@@ -270,23 +576,21 @@ def run_seqkit_locate(amplicon: str, ref_file: Path,logger: Logger):
         logger.info(
             f"Running seqkit locate on the following assembly {ref_file} with the amplicon."
         )
-        # Create subprocess to read the input file using 'cat'
-        cat = subprocess.Popen(["cat", ref_file], stdout=subprocess.PIPE, text=True)
-        # Pipe that output into subprocess that runs seqkit locate
+        # seqkit reads the reference itself, no need to pipe it through 'cat'
         logger.debug("started subprocess seqkit locate")
-        seqkit_out = subprocess.Popen(
-            ["seqkit", "locate", "-p", amplicon, "--bed", "-m", "2"],
-            stdin=cat.stdout,
+        # the bed output is plain ASCII, keep it as bytes instead of decoding it
+        with subprocess.Popen(
+            [_SEQKIT, "locate", "-p", amplicon, "--bed", "-m", "2", str(ref_file)],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
-        )
-        # get both the output and potential errors
-        output, error = seqkit_out.communicate()
+            close_fds=False,
+        ) as seqkit_out:
+            # get both the output and potential errors
+            output, error = seqkit_out.communicate()
 
         # check for errors THIS IS REDUNDANT, REMOVE IN NEXT ITERATION OF IMPROVAL
         if seqkit_out.returncode != 0:
-            logger.error(f"Error output from seqkit: {error}")
+            logger.error(f"Error output from seqkit: {error.decode(errors='replace')}")
             raise subprocess.CalledProcessError(seqkit_out.returncode, "seqkit locate")
 
         logger.debug("seqkit locate ran successfully, returning the output...")
@@ -303,6 +607,181 @@ def run_seqkit_locate(amplicon: str, ref_file: Path,logger: Logger):
         ) from e
 
 
+def write_blastx_query(target_files: list, query: Path) -> dict:
+    """
+    Write the sequences of all target files into one fasta file, so they can be blasted in a single request.
+
+    Args:
+        target_files (list): path objects of the target fastas
+        query (Path): the fasta file to write
+
+    Returns:
+        dict: maps the query id of each sequence in the query file to a tuple of its target file (Path) and its
+              original id (bytes). The targets all have the same header, so every sequence gets a new, unique id.
+    """
+    queries = {}
+    # fasta is ASCII, copy it as bytes without decoding
+    with open(query, "wb") as out_file:
+        for file_path in target_files:
+            line = b""
+            with open(file_path, "rb") as target:
+                for line in target:
+                    if line.startswith(b">"):
+                        query_id = b"query_%d" % len(queries)
+                        # blastx reports the first word of the header as query id
+                        header = line[1:].split(maxsplit=1)
+                        queries[query_id] = (file_path, header[0] if header else query_id)
+                        line = b">%s\n" % query_id
+                    out_file.write(line)
+                # targets without a final line break would otherwise run into the next header
+                if line and not line.endswith(b"\n"):
+                    out_file.write(b"\n")
+    return queries
+
+
+def run_blastx(query: Path, logger: Logger) -> bytes:
+    """
+    Run blastx remotely against nr.
+
+    Args:
+        query (Path): path object of the fasta file with the query sequences
+
+    Returns:
+        bytes: the blastx output in tabular format (outfmt 6)
+
+    Raises:
+        RuntimeError: If blastx fails.
+    """
+    try:
+        # Run the blastx command with the necessary parameters and capture stdout and stderr
+        result = subprocess.run(
+            [
+                "blastx",  # The blastx command for sequence alignment
+                "-query", str(query),  # Input file (query)
+                "-remote",  # Use remote database (instead of local)
+                "-db", "nr",  # Database to query against (nr - non-redundant)
+                "-evalue", "0.00001",  # E-value threshold for the alignment
+                "-outfmt", "6",  # Output format (tabular)
+            ],
+            stdout=subprocess.PIPE,  # Capture standard output
+            stderr=subprocess.PIPE,  # Capture standard error
+            check=True,  # Raise an error if the subprocess fails
+        )
+    except subprocess.CalledProcessError as e:
+        # If an error occurs while running blastx, log it and raise an exception
+        error = e.stderr.decode(errors="replace") if e.stderr else ""
+        logger.exception(f"Blastx failed: {error}")
+        raise RuntimeError(f"Blastx failed: {error}") from e
+    return result.stdout
+
+
+def split_blastx_output(output: bytes, queries: dict) -> dict:
+    """
+    Split the blastx output of a multi-query request by target file.
+
+    Args:
+        output (bytes): blastx output in tabular format (outfmt 6). The first column is the query id.
+        queries (dict): the query ids as returned by write_blastx_query
+
+    Returns:
+        dict: maps the target files (Path) to their blastx lines, with the original ids of the sequences restored
+    """
+    hits = {}
+    for line in output.splitlines(keepends=True):
+        query_id, sep, rest = line.partition(b"\t")
+        if query_id not in queries:
+            continue
+        file_path, original_id = queries[query_id]
+        hits.setdefault(file_path, []).append(original_id + sep + rest)
+    return hits
+
+
+def blastx_targets(target_files: list, work_dir: Path, logger: Logger) -> dict:
+    """
+    Blast the targets remotely in batches. The batches run in parallel, the remote requests only wait on the network.
+
+    Args:
+        target_files (list): path objects of the target fastas
+        work_dir (Path): folder for the query files of the batches, they are deleted afterwards
+
+    Returns:
+        dict: maps the target files (Path) to their blastx lines. Targets without hits are missing.
+              Targets with identical content are only blasted once and share the lines.
+
+    Raises:
+        RuntimeError: If blastx fails.
+    """
+
+    def blastx_batch(number: int, batch: list) -> dict:
+        query = work_dir / f"targets_blastx_query_{number}.fasta"
+        try:
+            queries = write_blastx_query(batch, query)
+            return split_blastx_output(run_blastx(query, logger), queries)
+        finally:
+            query.unlink(missing_ok=True)
+
+    # primer pairs from the same region have the same target sequence, blast each sequence once
+    identical = {}
+    for file_path in target_files:
+        identical.setdefault(hashlib.sha1(file_path.read_bytes()).digest(), []).append(file_path)
+    unique_files = [files[0] for files in identical.values()]
+
+    batches = [
+        unique_files[start:start + _BLASTX_BATCH_SIZE]
+        for start in range(0, len(unique_files), _BLASTX_BATCH_SIZE)
+    ]
+    hits = {}
+    with ThreadPoolExecutor(max_workers=_BLASTX_WORKERS) as executor:
+        futures = [executor.submit(blastx_batch, number, batch) for number, batch in enumerate(batches)]
+        for future in as_completed(futures):
+            hits.update(future.result())
+
+    for first, *duplicates in identical.values():
+        if first in hits:
+            for duplicate in duplicates:
+                hits[duplicate] = hits[first]
+    return hits
+
+
+def has_blastx_hits(target: Path) -> bool:
+    """
+    Check if an earlier run already wrote blastx hits for a target.
+
+    Args:
+        target (Path): path object of the target fasta
+
+    Returns:
+        bool: True if the blastx result file of the target exists, is not empty and is not older than the target.
+              Primer3 overwrites the targets of a run with the same prefix, the old results then belong to another sequence.
+    """
+    try:
+        result = Path(f"{target}{_BLASTX_SUFFIX}").stat()
+        return result.st_size > 0 and result.st_mtime >= target.stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def select_targets_to_blast(target_files: list, overwrite: bool, logger: Logger) -> list:
+    """
+    Leave out the targets that already have blastx hits from an earlier run, unless they should be blasted again.
+
+    Args:
+        target_files (list): path objects of the target fastas
+        overwrite (bool): if True, all targets are blasted again
+
+    Returns:
+        list: the targets that need blastx. Skipped targets keep their result files as they are.
+    """
+    if overwrite:
+        return target_files
+    to_blast = [file_path_tar for file_path_tar in target_files if not has_blastx_hits(file_path_tar)]
+    if len(to_blast) < len(target_files):
+        logger.info(
+            f"Skipping blastx for {len(target_files) - len(to_blast)} targets with results from an earlier run. Use --overwrite to rerun them."
+        )
+    return to_blast
+
+
 def get_amplicon(file: Path) -> str:
     """
     Extract the amplicon from the sequence file.
@@ -313,11 +792,30 @@ def get_amplicon(file: Path) -> str:
     Returns:
         The amplicon as a string.
     """
-    # open file, split first line by tab delimiter, return the amplicon in column 7
-    with file.open("r") as f:
+    # open file, split first line by tab delimiter, return the amplicon in column 7.
+    # Only the first line is read and decoded, the bed file can be large
+    with file.open("rb") as f:
         first_line = f.readline()
-        amplicon = first_line.strip().split("\t")[6]
-        return amplicon
+    amplicon = first_line.rstrip().split(b"\t", 7)[6]
+    return amplicon.decode()
+
+
+def get_fasta_length(filepath: str) -> int:
+    """
+    Get the total sequence length of a fasta file, without parsing it into records.
+
+    Args:
+        filepath (str): path to the fasta file
+
+    Returns:
+        int: number of bases in all sequences of the file (header lines and line breaks not counted)
+    """
+    total_length = 0
+    with open(filepath, "rb") as fasta:
+        for line in fasta:
+            if not line.startswith(b">"):
+                total_length += len(line.rstrip())
+    return total_length
 
 
 def get_longest_target(directory: Path) -> Path:
@@ -330,34 +828,46 @@ def get_longest_target(directory: Path) -> Path:
     Returns:
         The string representation of the path to the file with the longest assembly
     """
-    longest_length = 0
-    longest_file = None
-
-    # don't read in anything but fasta files
-    for filename in os.listdir(directory):
-        if (
-            filename.endswith(".fasta")
-            or filename.endswith(".fa")
-            or filename.endswith(".fna")
-        ):
-            filepath = os.path.join(directory, filename)
-            # Read sequences in the file
-            sequences = SeqIO.parse(filepath, "fasta")
-
-            # total length of all contigs together
-            total_length = sum(len(seq) for seq in sequences)
-
-            # if longer than previous longest assembly, replace with current assembly
-            if total_length > longest_length:
-                longest_length = total_length
-                longest_file = filepath
-        
+    # don't read in anything but fasta files, whatever the case of their file ending.
+    # scandir entries already know whether they are files
+    with os.scandir(directory) as entries:
+        fastas = [
+            entry.path for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in _FASTA_SUFFIXES
+        ]
+
+    # the assembly with the most bases in all contigs together
+    longest_file = max(fastas, key=get_fasta_length, default=None)
+
     # make sure that this function returns something or fails gracefully    
     if longest_file is None:
         raise RuntimeError("No valid FASTA files found in the directory.")
     return longest_file
 
 
+def link_duplicate_results(canonical: Path, duplicates: list, logger: Logger):
+    """
+    Hand the in silico PCR results of one primer file to primer files with the identical primer pair.
+
+    Args:
+        canonical (Path): the primer file seqkit amplicon was run for
+        duplicates (list): path objects of primer files with the same forward and reverse primer
+
+    Returns:
+        None
+    """
+    results = list(canonical.parent.glob(f"{canonical.name}_seqkit_amplicon_against_*"))
+    for duplicate in duplicates:
+        logger.info(f"{duplicate} has the same primers as {canonical}. Reusing its in silico results.")
+        for result in results:
+            linked = duplicate.parent / f"{duplicate.name}{result.name[len(canonical.name):]}"
+            try:
+                # a hardlink shares the data instead of copying it
+                os.link(result, linked)
+            except OSError:
+                shutil.copyfile(result, linked)
+
+
 def delete_concats(target: Path, neighbour: Path, logger: Logger):
     """
     Delete concatenated fasta files.
@@ -415,6 +925,20 @@ def main():
     parser.add_argument(
         "-r", "--ref", type=str, help="Reference assembly of the targets."
     )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=None,
+        help="Threads for each seqkit amplicon run with mismatches. Default: the CPUs split between the parallel runs.",
+    )
+    parser.add_argument(
+        "-O",
+        "--overwrite",
+        action="store_true",
+        help="Run blastx again for targets that already have blastx hits from an earlier run, newer than the target. Without it, these targets are skipped: "
+        "their blastx results are kept as they are and they are left out of the rest of the blastx step.",
+    )
     parser.add_argument(
         "-V", "--verbose", action="store_true", help="increase logging verbosity"
     )
@@ -426,9 +950,11 @@ def main():
     logger_instance = Logger(module_name, source_folder, args.verbose)
     logger = logger_instance.get_logger()
 
-    # Check if programs are installed
-    check_program_installed("seqkit")
-    check_program_installed("blastx")
+    # Check if programs are installed. This only looks them up on the PATH, nothing is run
+    for program in ("seqkit", "blastx"):
+        if not check_program_installed(program):
+            logger.error(f"{program} is not installed or not in the PATH")
+            sys.exit(f"{program} is not installed or not in the PATH")
 
     # Define the folders with primers and targets
     destination_folder_pr = source_folder / "FUR.P3.PRIMERS"
@@ -448,224 +974,214 @@ def main():
     concat_t = concat_files(fur_target, "target", source_folder, logger)
     concat_n = concat_files(fur_neighbour, "neighbour", source_folder, logger)
 
-    all_files = list(destination_folder_pr.glob("*"))
+    all_files = list_files(destination_folder_pr)
 
+    # group the primer files by primer pair. Primer3 output often repeats the same forward and
+    # reverse primer, and the in silico PCR only depends on those two, so run it once per pair
+    primer_pairs = {}
     for file_path in all_files:
-        if file_path.is_file():
-            logger.info(f"Testing your primers in {file_path}:\n")
-            try:
-                pr_frwd, pr_rev, pr_intern = extract_primer_sequences(file_path, logger)
-            except Exception as e:
-                logger.exception(
-                    f"Could not extract primer sequences from {file_path}: {e}",
-                    exc_info=1,
-                )
-                raise RuntimeError(
-                    f"Could not extract primer sequences from {file_path}: {e}"
-                ) from e
+        try:
+            pr_frwd, pr_rev, pr_intern = extract_primer_sequences(file_path, logger)
+        except Exception as e:
+            logger.exception(
+                f"Could not extract primer sequences from {file_path}: {e}",
+                exc_info=1,
+            )
+            raise RuntimeError(
+                f"Could not extract primer sequences from {file_path}: {e}"
+            ) from e
+        primer_pairs.setdefault((pr_frwd, pr_rev), []).append(file_path)
 
-            # runs seqkit amplicon for targets with max mismatches of 4
-            for i in range(4):
-                try:
-                    out_seqk_target = run_seqkit_amplicon_with_optional_timeout(
-                        pr_frwd, pr_rev, concat_t, i, logger
-                    )
-                except subprocess.CalledProcessError as e:
-                    logger.exception(f"Error running seqkit amplicon: {e}")
-                    raise subprocess.CalledProcessError(
-                        returncode=-1, cmd="seqkit amplicon", output="", stderr=str(e)
-                    ) from e
-                except OSError as e:
-                    logger.exception(
-                        f"Error with the operating system while running seqkit amplicon: {e}"
-                    )
-                    raise OSError(
-                        f"Error with the operating system while running seqkit amplicon: {e}"
-                    ) from e
-                except Exception as e:
-                    logger.exception(
-                        f"Unknown exception/ unexpected error running seqkit amplicon: {e}"
-                    )
-                    raise RuntimeError(
-                        f"Unknown exception/ unexpected error running seqkit amplicon: {e}"
-                    ) from e
-
-                if not out_seqk_target:
-                    logger.warning(
-                        f"Seqkit amplicon did not return any matches for the primers in the targets with -m flag at {i}"
-                    )
-                    continue
+    # all primer pairs go into one primer file, so seqkit reads each concatenated fasta
+    # once instead of once per primer pair
+    primer_table = write_primer_table(primer_pairs, source_folder / "primers_in_silico_pcr.tsv")
+    canonical_files = [files[0] for files in primer_pairs.values()]
+    logger.info(
+        "Testing your primers in " + ", ".join(str(file_path) for file_path in canonical_files) + ":\n"
+    )
 
-                try:
-                    # Construct filename for output
-                    filename = f"{file_path}_seqkit_amplicon_against_target_m{i}.txt"
-
-                    # Write output to the file
-                    with open(filename, "w", encoding="utf-8") as file:
-                        file.write(out_seqk_target)
-                except (IOError, OSError, PermissionError) as e:
-                    # Log error and raise exception with additional context
-                    logger.exception(
-                        f"Error writing output of seqkit amplicon to file {filename}: {e}"
-                    )
-                    raise RuntimeError(
-                        f"Error writing output of seqkit amplicon to file {filename}: {e}"
-                    ) from e
-            # run seqkit amplicon for neighbours with up to 5 mismatches. Time out after 8 min
-            for i in range(5):
-                try:
-                    out_seqk_neighbour = run_seqkit_amplicon_with_optional_timeout(
-                        pr_frwd, pr_rev, concat_n, i, logger, timeout=480)
-                    logger.info(f"ran seqkit amplicon for {i} mismatches")
-                except Exception as e:
-                    logger.exception(f"Error running seqkit amplicon: {e}")
-                    raise Exception(f"Error running seqkit amplicon: {e}") from e
-
-                if not out_seqk_neighbour:
-                    logger.warning(
-                        f"Seqkit amplicon did not return any matches for the primers in the neighbours with -m flag at {i}"
-                    )
+    # targets are tested with up to 3 mismatches, neighbours with up to 4.
+    # seqkit only runs once per concatenated fasta, with the most mismatches. Amplicons found with fewer
+    # mismatches are also found with more, so the lower levels are filtered from its output
+    max_m = {"target": 3, "neighbour": 4}
+    # neighbour runs get 8 min per primer pair. One run tests all primer pairs, a fixed 8 min would time out
+    # for many pairs and lose the neighbour results of all of them
+    timeouts = {"target": None, "neighbour": 480 * len(primer_pairs)}
+    concats = {"target": concat_t, "neighbour": concat_n}
+    primer_sequences = {files[0].name: (files[0], pair) for pair, files in primer_pairs.items()}
+
+    # the runs are independent, so run them in parallel. Each job mostly waits for its seqkit process,
+    # so threads are enough and the logger keeps its handlers (a process pool only keeps them under fork)
+    max_workers = get_max_workers(len(concats), max(concat_t.stat().st_size, concat_n.stat().st_size))
+    # the parallel runs share the CPUs instead of each starting a thread per CPU
+    threads = args.threads or max(1, available_cpus() // max_workers)
+    logger.info(f"Running seqkit amplicon on {len(concats)} fastas with {max_workers} workers and {threads} threads each.")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        # running jobs, by their future
+        jobs = {}
+
+        def submit(kind: str, i: int):
+            out_paths = {
+                file_path.name: Path(f"{file_path}_seqkit_amplicon_against_{kind}_m{i}.txt")
+                for file_path in canonical_files
+            }
+            future = executor.submit(
+                run_seqkit_amplicon_with_optional_timeout,
+                primer_table, concats[kind], i, out_paths, logger, timeouts[kind], threads
+            )
+            jobs[future] = kind, i, out_paths
+
+        # a fasta smaller than the shortest primer pair cannot contain an amplicon, don't start seqkit for it
+        shortest_pair = min(len(frwd) + len(rev) for frwd, rev in primer_pairs)
+        # the biggest fasta takes longest, start it first so the smaller one runs alongside it
+        for kind, concat in sorted(concats.items(), key=lambda item: item[1].stat().st_size, reverse=True):
+            if concat.stat().st_size < shortest_pair:
+                logger.warning(
+                    f"{concat} is smaller than the primers, so seqkit amplicon is not run against the {kind}s. There are no matches for any primers and mismatch levels."
+                )
+                continue
+            submit(kind, max_m[kind])
+        # handle the jobs as they complete, so a slow run does not hold up the results of finished ones.
+        # Jobs can be added while waiting, the loop picks them up
+        while jobs:
+            done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, i, out_paths = jobs.pop(future)
+                found = collect_amplicon_result(future, kind, i, out_paths, logger)
+                if i != max_m[kind]:
+                    continue
+                if found is None:
+                    # the run with the most mismatches timed out, so try the lower levels one by one
+                    logger.warning(f"Running seqkit amplicon against the {kind}s for each mismatch level below {i}")
+                    # more mismatches take longer, so those runs go first
+                    for j in reversed(range(i)):
+                        submit(kind, j)
                     continue
 
-                try:
-                    # Construct filename for output
-                    filename = f"{file_path}_seqkit_amplicon_against_target_m{i}.txt"
-
-                    # Write output to the file
-                    with open(filename, "w", encoding="utf-8") as file:
-                        file.write(out_seqk_target)
-                except (IOError, OSError, PermissionError) as e:
-                    # Log error and raise exception with additional context
-                    logger.error(
-                        f"Error writing output of seqkit amplicon to file {filename}: {e}"
-                    )
-                    raise RuntimeError(
-                        f"Error writing output of seqkit amplicon to file {filename}: {e}"
-                    )
+                for name in out_paths:
+                    file_path, (frwd, rev) = primer_sequences[name]
+                    level_paths = {
+                        j: Path(f"{file_path}_seqkit_amplicon_against_{kind}_m{j}.txt")
+                        for j in range(i)
+                    }
+                    levels = split_bed_by_mismatches(out_paths[name], frwd, rev, level_paths) if name in found else set()
+                    for j in sorted(level_paths.keys() - levels):
+                        logger.warning(
+                            f"Seqkit amplicon did not return any matches for the primers in {name} in the {kind}s with -m flag at {j}"
+                        )
+
+    primer_table.unlink()
+
+    # primer files with the identical primer pair get the results of the first one
+    for files in primer_pairs.values():
+        link_duplicate_results(files[0], files[1:], logger)
 
    # Log an informational message to indicate that the blastx command is starting
     logger.info("Running blastx on the targets...")
 
-    # Get a list of all files in the destination folder
-    all_files_tar = list(destination_folder_tar.glob("*"))
+    # Get a list of all files in the destination folder. The blastx results are written next to the targets,
+    # they are not targets themselves
+    all_files_tar = [
+        file_path_tar for file_path_tar in list_files(destination_folder_tar)
+        if not file_path_tar.name.endswith(_BLASTX_SUFFIX)
+    ]
+
+    # remote blastx is the slowest step. When a run is repeated, targets that already got hits are not blasted again.
+    # They are left out of the rest of the loop as well, seqkit locate is only needed for targets without hits anyway
+    all_files_tar = select_targets_to_blast(all_files_tar, args.overwrite, logger)
+
+    # the targets go to NCBI in batches instead of one remote blastx request per target
+    blastx_hits = blastx_targets(all_files_tar, source_folder, logger)
+
+    # Print the file paths for tracking purposes, in one write rather than one print per target
+    sys.stdout.write("".join(f"{file_path_tar}\n" for file_path_tar in all_files_tar))
+
+    # the reference for seqkit locate is the same for every target, only look for the longest assembly once
+    ref = Path(args.ref) if args.ref else None
 
     # Iterate through each file in the list
     for file_path_tar in all_files_tar:
-        if file_path_tar.is_file():  # Check if the current item is a file, not a directory
-            print(f"{file_path_tar}")  # Print the file path for tracking purposes
+        output_tar = b"".join(blastx_hits.get(file_path_tar, []))
 
-            try:
-                # Run the blastx command with the necessary parameters and capture stdout and stderr
-                result = subprocess.run(
-                    [
-                        "blastx",  # The blastx command for sequence alignment
-                        "-query", str(file_path_tar),  # Input file (query)
-                        "-remote",  # Use remote database (instead of local)
-                        "-db", "nr",  # Database to query against (nr - non-redundant)
-                        "-evalue", "0.00001",  # E-value threshold for the alignment
-                        "-outfmt", "6",  # Output format (tabular)
-                    ],
-                    stdout=subprocess.PIPE,  # Capture standard output
-                    stderr=subprocess.PIPE,  # Capture standard error
-                    text=True,  # Ensure output is returned as text
-                    check=True,  # Raise an error if the subprocess fails
-                )
-                output_tar = result.stdout  # Store the output of the blastx command
-            except RuntimeError as e:
-                # If an error occurs while running blastx, log it and raise an exception
-                logger.exception(f"Blastx failed: {e}")
-                raise RuntimeError(f"Blastx failed: {e}") from e
-
-            # If no output is generated by blastx, log a message and proceed with further steps
-            if not output_tar:
-                logger.info("Blastx did not return any results. No matches found.")
-
-                # Get the amplicon related to the current target file
-                file = (
-                    destination_folder_pr
-                    / f"{file_path_tar.name}_seqkit_amplicon_against_target_m0.txt"
-                )
-                file = Path(str(file).replace("Target", "Primer"))  # Adjust the file path for primer
-                amp = get_amplicon(file)  # Get the amplicon from the file
-                logger.info(f"The amplicon is {amp}")
+        try:
+            # Write the blastx output to a text file
+            filenamed = f"{file_path_tar}{_BLASTX_SUFFIX}"
+            with open(filenamed, "wb") as file_1:
+                file_1.write(output_tar)  # Save blastx results to a file
+        except OSError as e:
+            # If an error occurs while writing the blastx output, log it and raise an exception
+            logger.error(f"Error writing output of blastx to file {filenamed}: {e}")
+            raise OSError(f"Error writing output of blastx to file {filenamed}: {e}") from e
+
+        # If no output is generated by blastx, log a message and proceed with further steps
+        if not output_tar:
+            logger.info("Blastx did not return any results. No matches found.")
+
+            # Get the amplicon related to the current target file, the primer file has the same name with Primer for Target
+            file = destination_folder_pr / (
+                f"{file_path_tar.name.replace('Target', 'Primer')}_seqkit_amplicon_against_target_m0.txt"
+            )
+            amp = get_amplicon(file)  # Get the amplicon from the file
+            logger.info(f"The amplicon is {amp}")
 
-                # Check if a reference is provided, otherwise use the longest target assembly
-                try:
-                    if args.ref:
-                        ref = Path(args.ref)  # Use provided reference
-                        seqk_loc_out = run_seqkit_locate(amp, ref, logger)  # Run seqkit locate with the reference
-                    else:
-                        logger.warning("No reference found, using longest target assembly")
-                        ref = get_longest_target(fur_target)  # Get the longest target assembly
-                        if not ref:  # If no valid assembly is found, log and continue
-                            logger.warning(
-                                f"No valid assembly found in {fur_target} to run seqkit locate. Do the assembly fasta files end on .fa, .fasta, or .fna?"
-                            )
-                            continue
-                        logger.info(f"Using longest target assembly: {ref}")
-                        seqk_loc_out = run_seqkit_locate(amp, ref, logger)  # Run seqkit locate with the longest assembly
-
-                except Exception as e:
-                    # If an error occurs during seqkit locate, log it and raise an exception
-                    logger.error(f"Error running seqkit locate:{e}")
-                    raise Exception(f"Unknown exception running seqkit locate: {e}") from e
-
-                # If no results are returned from seqkit locate, log a warning and continue
-                if not seqk_loc_out:
-                    logger.warning(
-                        f'Seqkit locate did not return a bed file for the assembly {args.ref if args.ref else ref} with the amplicon "{amp}".\n'
-                    )
-                    continue
+            # Check if a reference is provided, otherwise use the longest target assembly
+            try:
+                if ref is None:
+                    logger.warning("No reference found, using longest target assembly")
+                    ref = Path(get_longest_target(fur_target))  # Get the longest target assembly
+                    logger.info(f"Using longest target assembly: {ref}")
+                seqk_loc_out = run_seqkit_locate(amp, ref, logger)  # Run seqkit locate with the reference
 
-                try:
-                    # Generate a file name for the bed file and write seqkit locate results to it
-                    match_no = re.search(r"_(\d+)\.txt", file_path_tar.name)
-                    ref = Path(ref)
-                    filename = f"Primer_{int(match_no.group(1))}_amplicon_locate_in_{ref.name}.bed"
-                    filename = source_folder / filename
-                    logger.info(f"Printing bed file for seqkit locate to {filename}")
-                    with open(filename, "w", encoding="utf-8") as file:
-                        logger.info("Writing results of seqkit locate to bed file...")
-                        file.write(seqk_loc_out)  # Write the locate results to the bed file
-                except OSError as e:
-                    # If an error occurs while writing the output to the file, log it and raise an exception
-                    logger.error(f"Error writing output of seqkit locate to file {filename}: {e}")
-                    raise OSError(f"Error writing output of seqkit locate to file {filename}: {e}") from e
+            except Exception as e:
+                # If an error occurs during seqkit locate, log it and raise an exception
+                logger.error(f"Error running seqkit locate:{e}")
+                raise Exception(f"Unknown exception running seqkit locate: {e}") from e
+
+            # If no results are returned from seqkit locate, log a warning and continue
+            if not seqk_loc_out:
+                logger.warning(
+                    f'Seqkit locate did not return a bed file for the assembly {ref} with the amplicon "{amp}".\n'
+                )
+                continue
 
             try:
-                # Write the blastx output to a text file
-                filenamed = f"{file_path_tar}_blastx_1e-5.txt"
-                with open(filenamed, "w", encoding="utf-8") as file_1:
-                    file_1.write(output_tar)  # Save blastx results to a file
+                # Generate a file name for the bed file and write seqkit locate results to it
+                match_no = _TRAIL_NUM_RE.search(file_path_tar.name)
+                filename = source_folder / f"Primer_{int(match_no.group(1))}_amplicon_locate_in_{ref.name}.bed"
+                logger.info(f"Printing bed file for seqkit locate to {filename}")
+                with open(filename, "wb") as file:
+                    logger.info("Writing results of seqkit locate to bed file...")
+                    file.write(seqk_loc_out)  # Write the locate results to the bed file
             except OSError as e:
-                # If an error occurs while writing the blastx output, log it and raise an exception
-                logger.error(f"Error writing output of blastx to file {filenamed}: {e}")
-                raise OSError(f"Error writing output of blastx to file {filenamed}: {e}") from e
+                # If an error occurs while writing the output to the file, log it and raise an exception
+                logger.error(f"Error writing output of seqkit locate to file {filename}: {e}")
+                raise OSError(f"Error writing output of seqkit locate to file {filename}: {e}") from e
 
-        # Move files that are related to seqkit testing into a subfolder called "in_silico_tests"
-        in_silico_folder = destination_folder_pr / "in_silico_tests"
-        in_silico_folder.mkdir(parents=True, exist_ok=True)  # Create the subfolder if it doesn't exist
-        pattern_to_match = "seqkit_amplicon_against"  # Pattern to search for in the file names
+    # Move files that are related to seqkit testing into a subfolder called "in_silico_tests"
+    in_silico_folder = destination_folder_pr / "in_silico_tests"
+    in_silico_folder.mkdir(parents=True, exist_ok=True)  # Create the subfolder if it doesn't exist
+    pattern_to_match = "seqkit_amplicon_against"  # Pattern to search for in the file names
 
-        logger.info(f"Moving files with {pattern_to_match} in name from {destination_folder_pr} into {in_silico_folder}...")
+    logger.info(f"Moving files with {pattern_to_match} in name from {destination_folder_pr} into {in_silico_folder}...")
 
-        try:
-            # Move files matching the pattern from the destination folder to the in_silico_tests folder
-            move_files_with_pattern(destination_folder_pr, pattern_to_match, in_silico_folder)
-        except Exception as e:
-            # If an error occurs during the file moving process, log it and raise an exception
-            logger.error(f"Error moving files with {pattern_to_match} in name from {destination_folder_pr} into {in_silico_folder}: {e}")
-            raise Exception(f"Error moving files with {pattern_to_match} in name from {destination_folder_pr} into {in_silico_folder}: {e}") from e
+    try:
+        # Move files matching the pattern from the destination folder to the in_silico_tests folder
+        move_files_with_pattern(destination_folder_pr, pattern_to_match, in_silico_folder)
+    except Exception as e:
+        # If an error occurs during the file moving process, log it and raise an exception
+        logger.error(f"Error moving files with {pattern_to_match} in name from {destination_folder_pr} into {in_silico_folder}: {e}")
+        raise Exception(f"Error moving files with {pattern_to_match} in name from {destination_folder_pr} into {in_silico_folder}: {e}") from e
 
-        # Log that the script has completed successfully
-        logger.info("Primer_Testing_module.py ran to completion: exit status 0")
+    # Log that the script has completed successfully
+    logger.info("Primer_Testing_module.py ran to completion: exit status 0")
 
-        # If the 'delete_concat' argument is set, delete concatenated files
-        if args.delete_concat:
-            delete_concats(concat_t, concat_n, logger)
+    # If the 'delete_concat' argument is set, delete concatenated files
+    if args.delete_concat:
+        delete_concats(concat_t, concat_n, logger)
 
-        # Exit the script successfully
-        sys.exit(0)
+    # Exit the script successfully
+    sys.exit(0)
 
 if __name__ == "__main__":
     main()
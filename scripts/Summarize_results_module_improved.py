@@ -7,12 +7,25 @@ import subprocess
 from shutil import which
 import re
 import os
+from contextlib import nullcontext
 from pprint import pformat
 from pprint import pprint
 import jinja2  # type: ignore
-import pandas as pd  # type: ignore
 from logging_handler import Logger
 
+# primer/target number in file names, e.g. "..._Primer_3.txt"
+_NUM_RE = re.compile(r"_(\d+)\.txt")
+# mismatch level in the in silico result file names, e.g. "..._m2.txt"
+_MISMATCH_RE = re.compile(r"_(m\d)\.txt")
+# headers of the primer and probe sequences in the Primer3 module output
+_PRIMER_KEY_RE = re.compile(r"PRIMER_(?:LEFT|RIGHT|INTERNAL)")
+# jinja2 environment for the html results, created once so each template is only loaded and compiled once.
+# Templates are found next to this script, and don't change during a run (no reload checks)
+_JINJA_ENV = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(os.path.dirname(os.path.realpath(__file__)), "templates/")),
+    auto_reload=False,
+)
+
 
 def generate_html_jinja(
     header: str,
@@ -34,6 +47,7 @@ def generate_html_jinja(
     source_folder: Path,
     qPCR: str,
     ampli_len: int,
+    stream=None,
 ):
     """
     Generate HTML content for the results.
@@ -56,6 +70,7 @@ def generate_html_jinja(
         seqkit_fold (Path): the Path object of the folder with the in silico testing results
         source_fold (Path): the Path object of the folder the entire thing is in (parent folder of all DiPPER2 results)
         qPCR (str): toggle of y or n to change formatting according to whether it is qPCR or not
+        stream: open Results.html to write to. If None, the file is opened for appending just for this primer.
 
     Returns:
         None
@@ -64,17 +79,11 @@ def generate_html_jinja(
     # hardcoded output file name
     HTML_OUTFILE = source_folder / "Results.html"
 
-    # return the directory of the script the function is called from, making sure that relative paths are converted to absolut paths
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-
-    # create jinja2 environments, load templates
-    environment = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(os.path.join(script_dir, "templates/"))
-    )
+    # load templates. The environment is shared, so they are only compiled for the first primer
     if qPCR == "y":
-        template = environment.get_template("results_qPCR.html")
+        template = _JINJA_ENV.get_template("results_qPCR.html")
     else:
-        template = environment.get_template("results.html")
+        template = _JINJA_ENV.get_template("results.html")
 
     # render the html file with provided arguments
     content = template.render(
@@ -99,8 +108,8 @@ def generate_html_jinja(
     )
 
     # appending
-    with open(HTML_OUTFILE, "a", encoding="utf-8") as stream:
-        stream.write(content)
+    with nullcontext(stream) if stream is not None else open(HTML_OUTFILE, "a", encoding="utf-8") as out:
+        out.write(content)
 
 
 def is_tool(name: str) -> bool:
@@ -196,7 +205,7 @@ def extract_number_from_filename(filename: str, logger: Logger) -> int:
     """
 
     # regex match the number
-    match = re.search(r"_(\d+)\.txt", filename)
+    match = _NUM_RE.search(filename)
     # if match is found, return the number
     if match:
         return int(match.group(1))
@@ -219,13 +228,18 @@ def extract_primer_sequences(file: Path, logger: Logger) -> tuple[str, str, str]
     # initialize empty dictionary
     sequences = {"PRIMER_LEFT": None, "PRIMER_RIGHT": None, "PRIMER_INTERNAL": None}
 
-    # if you find a line with the keys from sequences, then add the next line as a value to the key in this dictionary
+    # if you find a line with the keys from sequences, then add the next line as a value to the key in this dictionary.
+    # The file is streamed and only read until all three sequences are found, the same way the primer testing module reads it
+    missing = set(sequences)
     with file.open("r") as f:
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-            for key in sequences.keys():
-                if key in line:
-                    sequences[key] = lines[i + 1].strip()
+        lines = iter(f)
+        for line in lines:
+            match = _PRIMER_KEY_RE.search(line)
+            if match and match.group() in missing:
+                missing.discard(match.group())
+                sequences[match.group()] = next(lines, "").strip()
+                if not missing:
+                    break
 
     # did not find all keys (not all values in dictionary are truthy)? Throw error!
     if not all(sequences.values()):
@@ -256,8 +270,29 @@ def get_amplicon_length_from_seq(file: Path) -> int:
         return len(amplicon)
 
 
+def list_in_silico_files(folder: Path, file: str) -> dict:
+    """
+    Find the in silico testing files of a primer for the targets and the neighbours with one scan of the folder.
+
+    Args:
+        folder (Path): a path object corresponding to the folder with the in silico results (in the FUR.P3.PRIMERS) folder
+        file (str): the primer file
+
+    Returns:
+        a dictionary with the files of the "target" and of the "neighbour" tests (lists of path objects)
+    """
+    prefix = f"{file}_seqkit_amplicon_against_"
+    files = {"target": [], "neighbour": []}
+    for doc in folder.glob(f"{prefix}*_m*"):
+        # the name continues with target_m... or neighbour_m...
+        target_type = doc.name[len(prefix):].partition("_")[0]
+        if target_type in files:
+            files[target_type].append(doc)
+    return files
+
+
 def run_tests(
-    folder: Path, file: str, length: int, count: int, target_type: str, logger: Logger
+    folder: Path, file: str, length: int, count: int, target_type: str, logger: Logger, files: list = None
 ) -> dict:
     """
     Parse the Specificity and Sensitivity test results based on the in silico PCRs.
@@ -268,6 +303,7 @@ def run_tests(
         length (int): the length of the amplicon
         count (int): the number of targets or neighbours
         target_type (str): "target" or "neighbour"
+        files (list): the in silico testing files for target_type, as found by list_in_silico_files. If None, they are looked up in folder.
 
     Returns:
         a dictionary with the results for targets and neighbours (specificity and sensitivity). Raw numbers not interpreted.
@@ -277,7 +313,8 @@ def run_tests(
     )
     # find the in silico testing files
     file_pattern = f"{file}_seqkit_amplicon_against_{target_type}_m*"
-    files = list(folder.glob(file_pattern))
+    if files is None:
+        files = list(folder.glob(file_pattern))
     # initialize counters
     amp_f_overall, passed, failed, passed_n, failed_n = 0, 0, 0, 0, 0
     results_dict = {}
@@ -302,7 +339,7 @@ def run_tests(
         # for each file initialize
         try:
             # find out the number of mismatches based on file name
-            mismatch = re.search(r"_(m\d)\.txt", doc.name)
+            mismatch = _MISMATCH_RE.search(doc.name)
             if mismatch:
                 m_no = mismatch.group(1)
                 # print(f"Found match: {m_no}")
@@ -393,8 +430,82 @@ def run_tests(
     return results_dict
 
 
+def best_blastx_hits(primer_files: list, destination_folder_tar: Path, logger: Logger) -> list:
+    """
+    Collect the accessions of the highest scoring blastx hits of the targets of all primers.
+
+    Args:
+        primer_files (list): path objects of the primer files
+        destination_folder_tar (Path): the FUR.P3.TARGETS folder
+
+    Returns:
+        a sorted list of the accessions, without duplicates. Primers without blastx hits are left out.
+    """
+    ids = set()
+    for file_path in primer_files:
+        match = _NUM_RE.search(file_path.name)
+        if not file_path.is_file() or not match:
+            continue
+        blastx_file = next(destination_folder_tar.glob(f"*Target_{match.group(1)}.txt_blastx_1e-5.txt"), None)
+        if blastx_file is None or blastx_file.stat().st_size == 0:
+            continue
+        id, _, _ = get_highest_scoring_accession(blastx_file)
+        if id != "Blast did not find hits":
+            ids.add(id)
+    logger.info(f"Found {len(ids)} different accessions as best blastx hits.")
+    return sorted(ids)
+
+
+def fetch_titles(ids: list, logger: Logger) -> dict:
+    """
+    Get the titles (descriptions) of several protein accessions from NCBI with one efetch request.
+
+    Args:
+        ids (list): the accessions, as blastx reports them
+
+    Returns:
+        a dictionary of the accessions and their titles. Accessions efetch did not return a title for are missing,
+        the dictionary is empty if eutilities are not installed or the request failed.
+    """
+    if not ids or not is_tool("efetch"):
+        return {}
+    try:
+        efetch_r = subprocess.Popen(
+            ["efetch", "-db", "protein", "-id", ",".join(ids), "-format", "docsum"],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        # the accession is printed in front of each title, so the titles can be matched to the ids
+        xtract_r = subprocess.Popen(
+            ["xtract", "-pattern", "DocumentSummary", "-element", "AccessionVersion", "Title"],
+            stdin=efetch_r.stdout,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        # xtract holds its own copy of the pipe, efetch gets SIGPIPE if xtract exits early
+        efetch_r.stdout.close()
+        output, _ = xtract_r.communicate()
+        efetch_r.wait()
+    except OSError as e:
+        logger.warning(f"Fetching the titles of all accessions at once failed, fetching them one by one: {e}")
+        return {}
+
+    titles = {}
+    for line in output.splitlines():
+        accession, _, title = line.partition("\t")
+        titles[accession] = title.strip()
+
+    # blastx may report ids like ref|WP_000001.1|, look for the accession within them
+    return {
+        id: titles[part]
+        for id in ids
+        for part in (id, *id.split("|"))
+        if part in titles
+    }
+
+
 def handle_blasts_and_efetch(
-    destination_folder_tar: Path, number: int, logger: Logger
+    destination_folder_tar: Path, number: int, logger: Logger, titles: dict = None
 ) -> str:
     """
     Handle BLAST results and use efetch to get the highest scoring accession's title (description).
@@ -402,6 +513,7 @@ def handle_blasts_and_efetch(
     Args:
         destination_folder_tar (Path): the FUR.P3.TARGETS folder
         number (int): the identification number of the primer
+        titles (dict): titles of accessions that were already fetched (see fetch_titles). efetch is only run for accessions not in it.
 
     Returns:
         a string with information on the highest scoring target
@@ -460,7 +572,12 @@ def handle_blasts_and_efetch(
             f"Could not find highest scoring accession for blastx results: {e}"
         ) from e
 
-    # 3: make sure eutilities are in path
+    # 3: the title might have been fetched together with the ones of the other primers already
+    if titles and id in titles:
+        accession = "https://www.ncbi.nlm.nih.gov/protein/" + id + "/"
+        return f"The primer {number}'s target with the highest bitscore {bitscore} & evalue {evalue} has the accession {id} and codes for {titles[id]}. \nFurther information on the accession: {accession} \n"
+
+    # otherwise make sure eutilities are in path
     if is_tool("efetch"):
 
         # if eutilities are in path, find the annotation of the accession
@@ -493,7 +610,7 @@ def handle_blasts_and_efetch(
         return f"The primer {number}'s target with the highest bitscore {bitscore} & evalue {evalue} has the accession {id}. \nFurther information on the accession: {accession} \n"
 
 
-def get_highest_scoring_accession(blastx_file: Path) -> tuple[str, float, int]:
+def get_highest_scoring_accession(blastx_file: Path) -> tuple[str, float, int | float]:
     """
     Parse a BLASTX output file to find the highest scoring accession and its evalue.
 
@@ -501,39 +618,34 @@ def get_highest_scoring_accession(blastx_file: Path) -> tuple[str, float, int]:
         blastx_file (Path): a path object of the blastx results file for the target in question.
 
     Returns:
-        a tuple of the Accession of the highest scoring entry, its evalue and its bitscore
+        a tuple of the Accession of the highest scoring entry, its evalue and its bitscore (an int if blastx wrote it without decimals)
     """
     if not blastx_file.exists() or blastx_file.stat().st_size == 0:
         raise FileNotFoundError(
             f"Blastx did not find hits. No file with the suffix {blastx_file} exists."
         )
-    columns = [
-        "qseqid",
-        "sseqid",
-        "pident",
-        "length",
-        "mismatch",
-        "gapopen",
-        "qstart",
-        "qend",
-        "sstart",
-        "send",
-        "evalue",
-        "bitscore",
-    ]
+    # outfmt 6: sseqid is column 2, evalue column 11, bitscore column 12.
+    # The file is small, one scan for the first row with the highest bitscore is all that's needed
+    best = None
     try:
-        df = pd.read_csv(blastx_file, sep="\t", comment="#", names=columns)
-        if df.empty:
+        with blastx_file.open("r") as f:
+            for line in f:
+                # skip blank and comment lines
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                columns = line.split("\t")
+                bitscore = float(columns[11])
+                if best is None or bitscore > best[3]:
+                    best = (columns[1], float(columns[10]), columns[11], bitscore)
+        if best is None:
             raise ValueError(
                 f"The BLASTX file {blastx_file} is empty or does not contain expected data."
             )
-        highest_scoring_row = df.loc[df["bitscore"].idxmax()]
-        return (
-            highest_scoring_row["sseqid"],
-            highest_scoring_row["evalue"],
-            highest_scoring_row["bitscore"],
-        )
-    except:
+        # bitscores are only compared as floats, the reported one is written as in the file (2071 stays 2071)
+        sseqid, evalue, bitscore, _ = best
+        return sseqid, evalue, int(bitscore) if bitscore.isdigit() else float(bitscore)
+    except (ValueError, IndexError):
         return "Blast did not find hits", float("inf"), 0
 
 
@@ -637,6 +749,8 @@ def print_results(
     qPCR: str,
     ampli_len: int,
     logger: Logger,
+    txt_stream=None,
+    html_stream=None,
 ):
     """
     Does what it says on the tin:
@@ -659,13 +773,15 @@ def print_results(
         seqkit_fold (Path): the Path object of the folder with the in silico testing results
         source_fold (Path): the Path object of the folder the entire thing is in (parent folder of all DiPPER2 results)
         qPCR (str): toggle of y or n to change formatting according to whether it is qPCR or not
+        txt_stream: open Results.txt to write to. If None, the file is opened for appending just for this primer.
+        html_stream: open Results.html to write to. If None, the file is opened for appending just for this primer.
     Returns:
         None
     """
     # txt outfile
     result_out = source_folder / "Results.txt"
     logger.info(f"Writing results to the results file Results.txt in {source_folder}")
-    with open(result_out, "a", encoding="utf-8") as file:
+    with nullcontext(txt_stream) if txt_stream is not None else open(result_out, "a", encoding="utf-8") as file:
         file.write(header)
         file.write(primer_frwd)
         file.write(primer_rev)
@@ -728,6 +844,7 @@ def print_results(
         source_folder,
         qPCR,
         ampli_len,
+        html_stream,
     )
 
 
@@ -741,6 +858,9 @@ def generate_results(
     source_folder: Path,
     qPCR: str,
     logger: Logger,
+    titles: dict = None,
+    txt_stream=None,
+    html_stream=None,
 ):
     """
     Gets the primers & amplicon length, processes them for output, gets the results from the sensitivity and specificity tests
@@ -755,6 +875,9 @@ def generate_results(
         count_neighbour (int): the number of neighbours
         source_folder (Path): one folder to rule them all (the folder with all DiPPER results of this run)
         qPCR (str): a toggle whether qPCR primers are wanted and have been generated or not
+        titles (dict): titles of the best blastx hits that were already fetched from NCBI
+        txt_stream: open Results.txt, passed on to print_results
+        html_stream: open Results.html, passed on to print_results
 
     Returns:
         None
@@ -778,6 +901,8 @@ def generate_results(
     logger.info(
         "Assessing the in silico PCR results and determining Specificity and Sensitivity..."
     )
+    # the target and neighbour files are found in one scan of the folder
+    in_silico_files = list_in_silico_files(destination_seqkit, file_path.name)
     try:
         sensi = run_tests(
             destination_seqkit,
@@ -786,6 +911,7 @@ def generate_results(
             count_target,
             "target",
             logger,
+            in_silico_files["target"],
         )
     except Exception as e:
         logger.error(f"Sensitivity tests failed: {e}", exc_info=1)
@@ -799,6 +925,7 @@ def generate_results(
             count_neighbour,
             "neighbour",
             logger,
+            in_silico_files["neighbour"],
         )
     except Exception as e:
         logger.error(f"Specificity tests failed: {e}", exc_info=1)
@@ -809,7 +936,7 @@ def generate_results(
     )
     try:
         res_target_str = handle_blasts_and_efetch(
-            destination_folder_tar, number, logger
+            destination_folder_tar, number, logger, titles
         )
     except Exception as e:
         logger.error(f"BLASTX Target Testing failed: {e}", exc_info=1)
@@ -850,6 +977,8 @@ def generate_results(
         qPCR,
         ampli_len,
         logger,
+        txt_stream,
+        html_stream,
     )
 
 
@@ -930,20 +1059,29 @@ def main():
     # to be able to loop through each primer of the 4 candidates, find all the files and generate a list of paths (it is a generator object and yields Path objects with name and path attributes)
     all_files = list(destination_folder_pr.glob("*"))
 
-    # generate results
-    for file_path in all_files:
-        if file_path.is_file():
-            generate_results(
-                destination_folder_pr,
-                destination_folder_tar,
-                destination_folder_seqkit,
-                file_path,
-                count_target,
-                count_neighbour,
-                source_folder,
-                qPCR,
-                logger,
-            )
+    # the titles of the best blastx hits of all primers are fetched from NCBI in one request instead of one per primer
+    titles = fetch_titles(best_blastx_hits(all_files, destination_folder_tar, logger), logger)
+
+    # generate results. The results files are opened once for all primers, each primer's results are appended
+    with open(source_folder / "Results.txt", "a", encoding="utf-8") as txt_stream, open(
+        source_folder / "Results.html", "a", encoding="utf-8"
+    ) as html_stream:
+        for file_path in all_files:
+            if file_path.is_file():
+                generate_results(
+                    destination_folder_pr,
+                    destination_folder_tar,
+                    destination_folder_seqkit,
+                    file_path,
+                    count_target,
+                    count_neighbour,
+                    source_folder,
+                    qPCR,
+                    logger,
+                    titles,
+                    txt_stream,
+                    html_stream,
+                )
 
 
 if __name__ == "__main__":
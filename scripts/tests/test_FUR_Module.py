@@ -112,15 +112,13 @@ class TestFUR(unittest.TestCase):
     @patch("FUR_module_optimized.subprocess.run")
     @patch("FUR_module_optimized.Path.write_text")
     @patch("FUR_module_optimized.Path.stat")
-    @patch("FUR_module_optimized.Path.exists")
     @patch('builtins.print')
     @patch('sys.exit')
-    def test_furout_empty(self, mock_exit, mock_print, mock_exists, mock_stat, mock_write_text, mock_run, mock_logger_class):
+    def test_furout_empty(self, mock_exit, mock_print, mock_stat, mock_write_text, mock_run, mock_logger_class):
         # Create a mock logger instance
         mock_logger_instance = MagicMock()
         mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
         # Arrange
-        mock_exists.return_value = True  # Pretend file exists
         mock_stat.return_value.st_size = 0  # Pretend file is empty
         mock_run.return_value.returncode = 0  # Pretend subprocess.run is successful
 
@@ -141,17 +139,15 @@ class TestFUR(unittest.TestCase):
     @patch("FUR_module_optimized.subprocess.run")
     @patch("FUR_module_optimized.Path.write_text")
     @patch("FUR_module_optimized.Path.stat")
-    @patch("FUR_module_optimized.Path.exists")
     @patch('builtins.print')
     @patch('sys.exit')
-    def test_furout_not_existing(self, mock_exit, mock_print, mock_exists, mock_stat, mock_write_text, mock_run, mock_logger_class):
+    def test_furout_not_existing(self, mock_exit, mock_print, mock_stat, mock_write_text, mock_run, mock_logger_class):
         # Create a mock logger instance
         mock_logger_instance = MagicMock()
         mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
 
         # Arrange
-        mock_exists.return_value = False  # Pretend file doesn't exist
-        mock_stat.return_value.st_size = 1  # Pretend file is not empty
+        mock_stat.side_effect = FileNotFoundError  # a missing file cannot be stat'ed
         mock_run.return_value.returncode = 0  # Pretend subprocess.run is successful
 
         # Test directory and file name
@@ -212,15 +208,13 @@ class TestFUR(unittest.TestCase):
     @patch('FUR_module_optimized.Logger')
     @patch('FUR_module_optimized.Path.write_text')
     @patch('FUR_module_optimized.Path.stat')
-    @patch('FUR_module_optimized.Path.exists')
     @patch('FUR_module_optimized.subprocess.run')
-    def test_run_fur(self, mock_subprocess_run, mock_exists, mock_stat, mock_write_text, mock_logger_class):
+    def test_run_fur(self, mock_subprocess_run, mock_stat, mock_write_text, mock_logger_class):
         # Create a mock logger instance
         mock_logger_instance = MagicMock()
         mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
 
         # make sure it thinks the file exists and is not empty
-        mock_exists.return_value = True
         mock_stat.return_value.st_size = 100
         mock_subprocess_run.return_value.stdout = "FUR output"
         mock_subprocess_run.return_value.stderr = ""
@@ -238,9 +232,8 @@ class TestFUR(unittest.TestCase):
     @patch('FUR_module_optimized.Logger')
     @patch('FUR_module_optimized.Path.write_text')
     @patch('FUR_module_optimized.Path.stat')
-    @patch('FUR_module_optimized.Path.exists')
     @patch('FUR_module_optimized.subprocess.run')
-    def test_run_fur_error(self, mock_subprocess_run, mock_exists, mock_stat, mock_write_text, mock_logger_class):
+    def test_run_fur_error(self, mock_subprocess_run, mock_stat, mock_write_text, mock_logger_class):
         # Create a mock logger instance
         mock_logger_instance = MagicMock()
         mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
@@ -249,7 +242,6 @@ class TestFUR(unittest.TestCase):
         mock_subprocess_run.side_effect=subprocess.CalledProcessError(1, 'fur')
 
         # make sure it thinks the file exists and is not empty
-        mock_exists.return_value = True
         mock_stat.return_value.st_size = 100
     
         #parameters
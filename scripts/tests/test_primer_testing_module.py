@@ -1,24 +1,45 @@
 #! /usr/bin/python
 
+import os
+import errno
 import unittest
 from pathlib import Path
 import tempfile
 import shutil
 import subprocess
+import io
+from contextlib import redirect_stdout
 from unittest.mock import patch, MagicMock
+from concurrent.futures import Future
 
 from Bio import SeqIO
 from Primer_Testing_module_optimized import (
+    _SEQKIT,
+    blastx_targets,
     check_folders,
+    collect_amplicon_result,
     check_program_installed,
     concat_files,
     delete_concats,
     extract_primer_sequences,
     move_files_with_pattern,
     get_amplicon,
+    get_fasta_length,
     get_longest_target,
+    get_max_workers,
+    has_blastx_hits,
+    available_cpus,
+    link_duplicate_results,
+    main,
+    list_files,
     run_seqkit_amplicon_with_optional_timeout,
+    run_blastx,
     run_seqkit_locate,
+    select_targets_to_blast,
+    split_bed_by_mismatches,
+    split_blastx_output,
+    write_blastx_query,
+    write_primer_table,
 )
 
 class test_util_functions (unittest.TestCase):
@@ -87,6 +108,14 @@ class test_util_functions (unittest.TestCase):
         result=check_program_installed("cd")
         self.assertTrue(result)
 
+    def test_list_files(self):
+        # subfolders are left out, files are sorted
+        Path(self.test_dir, "in_silico_tests").mkdir()
+        self.assertEqual(
+            list_files(Path(self.test_dir)),
+            [Path(self.test_dir) / "FUR.db", Path(self.test_dir) / "primer_123.txt"],
+        )
+
     def test_check_program_installed_None(self):
         # test with program that should always be installed
         result=check_program_installed("Superkalifragilistikexpialegetisch")
@@ -132,6 +161,54 @@ class test_file_ops(unittest.TestCase):
         content_outfile=Path(outfile).read_text()
         self.assertEqual(content_outfile, "Not sure I hate testing \nor I love it \n")
 
+    @patch('Primer_Testing_module_optimized.Logger')
+    def test_concat_files_reused_if_up_to_date(self, mock_logger_class):
+        mock_logger_instance = MagicMock()
+        mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
+
+        outfile = concat_files(Path(self.folder), "target", Path(self.source), mock_logger_instance)
+        # mark the concatenated file, it must not be written again
+        outfile.write_text("cached\n")
+        concat_files(Path(self.folder), "target", Path(self.source), mock_logger_instance)
+        self.assertEqual(outfile.read_text(), "cached\n")
+
+        # a changed input file makes it stale
+        os.utime(outfile, (0, 0))
+        concat_files(Path(self.folder), "target", Path(self.source), mock_logger_instance)
+        self.assertEqual(outfile.read_text(), "Not sure I hate testing \nor I love it \n")
+
+    @patch('Primer_Testing_module_optimized.os.sendfile', side_effect=OSError(errno.EINVAL, "Invalid argument"))
+    @patch('Primer_Testing_module_optimized.Logger')
+    def test_concat_files_without_sendfile(self, mock_logger_class, mock_sendfile):
+        mock_logger_instance = MagicMock()
+        mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
+
+        # falls back to copying through python
+        concat_files(Path(self.folder), "target", Path(self.source), mock_logger_instance)
+
+        outfile=Path(self.source)/"target_concatenated.fasta"
+        self.assertEqual(outfile.read_text(), "Not sure I hate testing \nor I love it \n")
+        mock_sendfile.assert_called()
+
+    @patch('Primer_Testing_module_optimized.Logger')
+    def test_concat_files_failure_leaves_no_partial_file(self, mock_logger_class):
+        mock_logger_instance = MagicMock()
+        mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
+
+        def copy_then_fail(readfile, outfile):
+            outfile.write(b"half a fasta")
+            raise OSError(errno.EIO, "Input/output error")
+
+        # a failed concatenation must not leave a truncated file that the next run reuses
+        with patch('Primer_Testing_module_optimized.copy_file_content', side_effect=copy_then_fail):
+            with self.assertRaises(OSError):
+                concat_files(Path(self.folder), "target", Path(self.source), mock_logger_instance)
+        self.assertEqual(os.listdir(self.source), [])
+
+        outfile = concat_files(Path(self.folder), "target", Path(self.source), mock_logger_instance)
+        self.assertEqual(outfile.read_text(), "Not sure I hate testing \nor I love it \n")
+        self.assertEqual(os.listdir(self.source), [outfile.name])
+
     @patch('Primer_Testing_module_optimized.Path.glob')
     @patch('Primer_Testing_module_optimized.Logger')
     def test_no_files_found_exception_bycount(self, mock_logger_class, mock_glob):
@@ -291,28 +368,20 @@ class test_move_files_with_pattern(unittest.TestCase):
         shutil.rmtree(self.source_dir)
         shutil.rmtree(self.destination_dir)
 
-    @patch("shutil.move")
-    #@patch("pathlib.Path.mkdir")
-    @patch("pathlib.Path.iterdir")
-    def test_no_matching_files(self, mock_iterdir,  mock_shutil_move):
-        # Mock source and destination directories
-        source_dir = MagicMock(spec=Path)
+    @patch("Primer_Testing_module_optimized.shutil.move")
+    @patch("Primer_Testing_module_optimized.os.rename")
+    def test_no_matching_files(self, mock_rename, mock_shutil_move):
+        # Mock destination directory
         destination_dir = MagicMock(spec=Path)
 
-        # Mock no matching files in the source directory
-        mock_file1 = MagicMock(spec=Path)
-        mock_file1.name = "file1.txt"
-        mock_file1.is_file.return_value = True
-
-        mock_iterdir.return_value = [mock_file1]
-
-        # Call the function
-        move_files_with_pattern(source_dir, "pattern", destination_dir)
+        # Call the function, the only file in the source folder does not match
+        move_files_with_pattern(Path(self.source_dir), "nomatch", destination_dir)
 
         # Assert mkdir was called
         destination_dir.mkdir.assert_called_once_with(exist_ok=True) 
 
-        # Assert shutil.move was not called since no files matched
+        # Assert nothing was moved since no files matched
+        mock_rename.assert_not_called()
         mock_shutil_move.assert_not_called()
 
     @patch("pathlib.Path.mkdir")
@@ -325,8 +394,62 @@ class test_move_files_with_pattern(unittest.TestCase):
         # Assert mkdir was called
         mock_mkdir.assert_called_once_with(exist_ok=True) 
 
-        # Assert shutil.move was not called since no files matched
-        mock_shutil_move.assert_called_once()
+        # Assert the file was renamed, shutil.move is only the cross-device fallback
+        mock_shutil_move.assert_not_called()
+        self.assertFalse(self.file1.exists())
+        self.assertTrue((Path(self.destination_dir) / self.file1.name).exists())
+
+    @patch("Primer_Testing_module_optimized.shutil.move")
+    @patch("Primer_Testing_module_optimized.os.rename", side_effect=OSError(errno.EXDEV, "Invalid cross-device link"))
+    def test_matching_files_cross_device(self, mock_rename, mock_shutil_move):
+
+        # Call the function
+        move_files_with_pattern(Path(self.source_dir), "pattern", Path(self.destination_dir))
+
+        # Assert the rename was tried first and shutil.move took over
+        mock_rename.assert_called_once()
+        mock_shutil_move.assert_called_once_with(str(self.file1), str(Path(self.destination_dir) / self.file1.name))
+
+class test_link_duplicate_results(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.canonical = Path(self.source_dir) / "run_Primer_1.txt"
+        self.duplicate = Path(self.source_dir) / "run_Primer_2.txt"
+        self.canonical.touch()
+        self.duplicate.touch()
+        self.result = Path(self.source_dir) / "run_Primer_1.txt_seqkit_amplicon_against_target_m0.txt"
+        with self.result.open("w") as f:
+            f.write("CP162103.1\t2274251\t2274479\t.\t0\t-\tTCGTCG\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+
+    @patch("Primer_Testing_module_optimized.Logger")
+    def test_results_are_linked(self, mock_logger_class):
+        mock_logger_instance = MagicMock()
+        mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
+
+        link_duplicate_results(self.canonical, [self.duplicate], mock_logger_instance)
+
+        linked = Path(self.source_dir) / "run_Primer_2.txt_seqkit_amplicon_against_target_m0.txt"
+        self.assertTrue(linked.exists())
+        self.assertEqual(linked.read_text(), self.result.read_text())
+        mock_logger_instance.info.assert_called_once()
+
+    @patch("Primer_Testing_module_optimized.shutil.copyfile")
+    @patch("Primer_Testing_module_optimized.os.link", side_effect=OSError("no hardlinks here"))
+    @patch("Primer_Testing_module_optimized.Logger")
+    def test_falls_back_to_copy(self, mock_logger_class, mock_link, mock_copyfile):
+        mock_logger_instance = MagicMock()
+        mock_logger_class.return_value.get_logger.return_value = mock_logger_instance
+
+        link_duplicate_results(self.canonical, [self.duplicate], mock_logger_instance)
+
+        mock_link.assert_called_once()
+        mock_copyfile.assert_called_once_with(
+            self.result, Path(self.source_dir) / "run_Primer_2.txt_seqkit_amplicon_against_target_m0.txt"
+        )
 
 class test_get_amplicon(unittest.TestCase):
     def setUp(self):
@@ -384,6 +507,18 @@ class test_longest_target(unittest.TestCase):
         #assert this is true
         self.assertEqual(result, str(expect))
 
+    def test_upper_case_suffix(self):
+        longest=Path(self.sourced)/"LONGEST.FASTA"
+        longest.write_text(">test\n" + "ACGT" * 50 + "\n")
+        self.assertEqual(get_longest_target(Path(self.sourced)), str(longest))
+
+    def test_fasta_length(self):
+        # headers and line breaks do not count, multi line contigs do
+        multi=Path(self.sourced)/"multi_contig.fa"
+        multi.write_text(">contig1 some description\nACGT\nAC\n>contig2\r\nGGG\r\n")
+        self.assertEqual(get_fasta_length(str(multi)), 9)
+        self.assertEqual(get_fasta_length(str(self.file1)), 24)
+
     def test_not_fasta(self):
         #there is only the readme, which is skipped, so longest_file is None, which raises this error 
         with self.assertRaises(RuntimeError):
@@ -392,6 +527,35 @@ class test_longest_target(unittest.TestCase):
 
 class test_run_seqkit_amplicon_w_optional_timeout(unittest.TestCase):
 
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.primer_table = Path(self.out_dir) / "primers_in_silico_pcr.tsv"
+        self.out_paths = {
+            "primer_1.txt": Path(self.out_dir) / "primer_1.txt_seqkit_amplicon_against_target_m1.txt",
+            "primer_2.txt": Path(self.out_dir) / "primer_2.txt_seqkit_amplicon_against_target_m1.txt",
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    @staticmethod
+    def _seqkit_popen(mock_popen, lines, error, returncode):
+        # mock a seqkit process that is used as context manager and writes its bed lines into the file it gets as stdout
+        process = MagicMock()
+        process.__enter__.return_value = process
+        process.communicate.return_value = (None, error.encode())
+        process.returncode = returncode
+
+        def start(args, **kwargs):
+            kwargs["stdout"].write("".join(lines).encode())
+            return process
+        mock_popen.side_effect = start
+        return process
+
+    def _no_files_left(self):
+        # neither result files nor the bed file of the run
+        return os.listdir(self.out_dir) == []
+
     @patch("subprocess.Popen")
     @patch("Primer_Testing_module_optimized.Logger")  
     def test_valid_input_no_timeout(self, mock_logger, mock_popen):
@@ -399,38 +563,82 @@ class test_run_seqkit_amplicon_w_optional_timeout(unittest.TestCase):
         mock_logger_instance = MagicMock()
         mock_logger.return_value = mock_logger_instance
 
-        # Prepare mock for subprocess.Popen
-        mock_cat_process = MagicMock()
-        mock_seqkit_process = MagicMock()
-
-        # Mock the subprocess calls for 'cat' and 'seqkit'
-        mock_cat_process.stdout = MagicMock()  # Mock stdout for the 'cat' process
-        mock_seqkit_process.communicate.return_value = ("output", "")  # Simulating success output
-        mock_seqkit_process.returncode = 0
-        mock_popen.side_effect = [mock_cat_process, mock_seqkit_process]
+        # Prepare mock for subprocess.Popen, only the first primer pair has amplicons
+        lines = ["seq1\t1\t5\tprimer_1.txt\t0\t+\tATCGA\n", "seq2\t3\t7\tprimer_1.txt\t0\t-\tGGCCA\n"]
+        mock_seqkit_process = self._seqkit_popen(mock_popen, lines, "", 0)  # Simulating success output
 
         # Test data
-        frwd = "forward_primer"
-        rev = "reverse_primer"
         concat = "file.fasta"
         number = 1
         timeout = None
 
         # Run the function
-        result = run_seqkit_amplicon_with_optional_timeout(frwd, rev, concat, number, mock_logger_instance, timeout)
+        result = run_seqkit_amplicon_with_optional_timeout(self.primer_table, concat, number, self.out_paths, mock_logger_instance, timeout)
 
         # Assertions
-        self.assertEqual(result, "output")
+        self.assertEqual(result, {"primer_1.txt"})
+        self.assertEqual(self.out_paths["primer_1.txt"].read_text(), "".join(lines))
+        # no amplicons, no file
+        self.assertFalse(self.out_paths["primer_2.txt"].exists())
         mock_logger_instance.info.assert_called_with(
-            "Seqkit amplicon ran successfully. Output size: 6 characters."
+            f"Seqkit amplicon ran successfully. Output size: {len(''.join(lines))} characters."
         )
-        mock_popen.assert_any_call(
-            ["seqkit", "amplicon", "-F", frwd, "-R", rev, "--bed", "-m", str(number)],
-            stdin=mock_cat_process.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        # seqkit reads the concatenated file directly and gets all primer pairs at once
+        self.assertEqual(
+            mock_popen.call_args[0][0],
+            [_SEQKIT, "amplicon", "-p", str(self.primer_table), "--bed", "-m", str(number), "-j", str(available_cpus()), concat],
         )
-        #since we use text=TRUE, the result must be a string
-        self.assertIsInstance(result, str)
+        mock_seqkit_process.communicate.assert_called_once_with(timeout=None)
+        # the bed file of the run is removed
+        self.assertFalse(list(Path(self.out_dir).glob("*.bed")))
 
+    @patch("subprocess.Popen")
+    @patch("Primer_Testing_module_optimized.Logger")  
+    def test_threads(self, mock_logger, mock_popen):
+        mock_logger_instance = MagicMock()
+        mock_logger.return_value = mock_logger_instance
+        self._seqkit_popen(mock_popen, [], "", 0)
+
+        # a user given number of threads for the mismatch search
+        run_seqkit_amplicon_with_optional_timeout(self.primer_table, "file.fasta", 2, self.out_paths, mock_logger_instance, threads=3)
+        self.assertEqual(mock_popen.call_args[0][0][-3:], ["-j", "3", "file.fasta"])
+        # the go runtime is limited to the same number of threads
+        self.assertEqual(mock_popen.call_args[1]["env"]["GOMAXPROCS"], "3")
+
+        # no threads without mismatches
+        run_seqkit_amplicon_with_optional_timeout(self.primer_table, "file.fasta", 0, self.out_paths, mock_logger_instance, threads=3)
+        self.assertNotIn("-j", mock_popen.call_args[0][0])
+        self.assertIsNone(mock_popen.call_args[1]["env"])
+
+    @patch("subprocess.Popen")
+    @patch("Primer_Testing_module_optimized.Logger")  
+    def test_single_primer_pair(self, mock_logger, mock_popen):
+        mock_logger_instance = MagicMock()
+        mock_logger.return_value = mock_logger_instance
+
+        lines = ["seq1\t1\t5\tprimer_1.txt\t0\t+\tATCGA\n"]
+        self._seqkit_popen(mock_popen, lines, "", 0)
+        out_paths = {"primer_1.txt": self.out_paths["primer_1.txt"]}
+
+        result = run_seqkit_amplicon_with_optional_timeout(self.primer_table, "file.fasta", 0, out_paths, mock_logger_instance)
+
+        # the bed file becomes the result file
+        self.assertEqual(result, {"primer_1.txt"})
+        self.assertEqual(os.listdir(self.out_dir), [self.out_paths["primer_1.txt"].name])
+        self.assertEqual(self.out_paths["primer_1.txt"].read_text(), "".join(lines))
+
+    @patch("subprocess.Popen")
+    @patch("Primer_Testing_module_optimized.Logger")  
+    def test_no_amplicons_no_files(self, mock_logger, mock_popen):
+        mock_logger_instance = MagicMock()
+        mock_logger.return_value = mock_logger_instance
+
+        self._seqkit_popen(mock_popen, [], "", 0)
+
+        result = run_seqkit_amplicon_with_optional_timeout(self.primer_table, "file.fasta", 0, self.out_paths, mock_logger_instance)
+
+        self.assertEqual(result, set())
+        self.assertTrue(self._no_files_left())
 
     @patch("subprocess.Popen")
     @patch("Primer_Testing_module_optimized.Logger")  
@@ -439,24 +647,25 @@ class test_run_seqkit_amplicon_w_optional_timeout(unittest.TestCase):
         mock_logger_instance = MagicMock()
         mock_logger.return_value = mock_logger_instance
 
-        # Mock subprocess to simulate timeout
-        mock_process = MagicMock()
-        mock_process.communicate.side_effect = subprocess.TimeoutExpired("seqkit amplicon", 10)
-        mock_popen.return_value = mock_process
+        # Mock subprocess, the process gets one line out before it times out
+        mock_process = self._seqkit_popen(mock_popen, ["seq1\t1\t5\tprimer_2.txt\t0\t+\tATCGA\n"], "", -9)
+        mock_process.communicate.side_effect = [subprocess.TimeoutExpired("seqkit", 10), (None, b"")]
 
         # Test data
-        frwd = "forward_primer"
-        rev = "reverse_primer"
         concat = "file.fasta"
         number = 1
         timeout = 10
 
         # Run the function (expecting timeout)
-        result = run_seqkit_amplicon_with_optional_timeout(frwd, rev, concat, number, mock_logger_instance, timeout)
+        result = run_seqkit_amplicon_with_optional_timeout(self.primer_table, concat, number, self.out_paths, mock_logger_instance, timeout)
 
-        # Assertions
+        # Assertions, partial output is removed
         self.assertIsNone(result)
+        self.assertTrue(self._no_files_left())
         mock_logger_instance.warning.assert_called_with(f"Seqkit amplicon timed out after {timeout} seconds.")
+        mock_process.communicate.assert_any_call(timeout=timeout)
+        # the seqkit process is killed
+        mock_process.kill.assert_called_once()
 
     @patch("subprocess.Popen")
     @patch("Primer_Testing_module_optimized.Logger")  
@@ -465,15 +674,15 @@ class test_run_seqkit_amplicon_w_optional_timeout(unittest.TestCase):
         mock_logger_instance = MagicMock()
         mock_logger.return_value = mock_logger_instance
 
-        # Test invalid case where no forward primer is provided
-        frwd = ""
-        rev = "reverse_primer"
+        # Test invalid case where no primer file is provided
         concat = "file.fasta"
         number = 1
         timeout = None
 
         with self.assertRaises(ValueError):
-            run_seqkit_amplicon_with_optional_timeout(frwd, rev, concat, number, mock_logger_instance, timeout)
+            run_seqkit_amplicon_with_optional_timeout(None, concat, number, self.out_paths, mock_logger_instance, timeout)
+        with self.assertRaises(ValueError):
+            run_seqkit_amplicon_with_optional_timeout(self.primer_table, concat, number, {}, mock_logger_instance, timeout)
 
     @patch("subprocess.Popen")
     @patch("Primer_Testing_module_optimized.Logger")  
@@ -483,14 +692,12 @@ class test_run_seqkit_amplicon_w_optional_timeout(unittest.TestCase):
         mock_logger.return_value = mock_logger_instance
 
         # Test invalid mismatch number
-        frwd = "forward_primer"
-        rev = "reverse_primer"
         concat = "file.fasta"
         number = -1
         timeout = None
 
         with self.assertRaises(ValueError):
-            run_seqkit_amplicon_with_optional_timeout(frwd, rev, concat, number, mock_logger_instance, timeout)
+            run_seqkit_amplicon_with_optional_timeout(self.primer_table, concat, number, self.out_paths, mock_logger_instance, timeout)
 
     @patch("subprocess.Popen")
     @patch("Primer_Testing_module_optimized.Logger")  
@@ -500,20 +707,16 @@ class test_run_seqkit_amplicon_w_optional_timeout(unittest.TestCase):
         mock_logger.return_value = mock_logger_instance
 
         # Mock subprocess to simulate seqkit failure (non-zero returncode)
-        mock_process = MagicMock()
-        mock_process.communicate.return_value = ("", "error")
-        mock_process.returncode = 1
-        mock_popen.return_value = mock_process
+        self._seqkit_popen(mock_popen, ["seq1\t1\t5\tprimer_1.txt\t0\t+\tATCGA\n"], "error", 1)
 
         # Test data
-        frwd = "forward_primer"
-        rev = "reverse_primer"
         concat = "file.fasta"
         number = 1
         timeout = None
 
         with self.assertRaises(subprocess.CalledProcessError):
-            run_seqkit_amplicon_with_optional_timeout(frwd, rev, concat, number, mock_logger_instance, timeout)
+            run_seqkit_amplicon_with_optional_timeout(self.primer_table, concat, number, self.out_paths, mock_logger_instance, timeout)
+        self.assertTrue(self._no_files_left())
 
     @patch("subprocess.Popen")
     @patch("Primer_Testing_module_optimized.Logger")  
@@ -526,14 +729,175 @@ class test_run_seqkit_amplicon_w_optional_timeout(unittest.TestCase):
         mock_popen.side_effect = Exception("Unexpected error")
 
         # Test data
-        frwd = "forward_primer"
-        rev = "reverse_primer"
         concat = "file.fasta"
         number = 1
         timeout = None
 
         with self.assertRaises(Exception):
-            run_seqkit_amplicon_with_optional_timeout(frwd, rev, concat, number, mock_logger_instance, timeout)
+            run_seqkit_amplicon_with_optional_timeout(self.primer_table, concat, number, self.out_paths, mock_logger_instance, timeout)
+        self.assertTrue(self._no_files_left())
+
+
+class test_collect_amplicon_result(unittest.TestCase):
+
+    def test_warns_for_primers_without_amplicons(self):
+        mock_logger = MagicMock()
+        future = Future()
+        future.set_result({"primer_1.txt"})
+        out_paths = {"primer_1.txt": Path("a"), "primer_2.txt": Path("b")}
+
+        found = collect_amplicon_result(future, "target", 3, out_paths, mock_logger)
+
+        self.assertEqual(found, {"primer_1.txt"})
+        mock_logger.warning.assert_called_once_with(
+            "Seqkit amplicon did not return any matches for the primers in primer_2.txt in the targets with -m flag at 3"
+        )
+
+    def test_failed_job(self):
+        mock_logger = MagicMock()
+        future = Future()
+        future.set_exception(subprocess.CalledProcessError(1, "seqkit amplicon"))
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            collect_amplicon_result(future, "neighbour", 0, {"primer_1.txt": Path("a")}, mock_logger)
+        mock_logger.exception.assert_called_once()
+
+
+class test_split_bed_by_mismatches(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.bed = Path(self.test_dir) / "primer_1.txt_seqkit_amplicon_against_target_m3.txt"
+        # forward primer ACGTAC, reverse primer GGTTCA (binding site on the amplicon: TGAACC)
+        self.exact = "seq1\t0\t16\tprimer_1.txt\t0\t+\tACGTACttttTGAACC\n"
+        self.one_mismatch = "seq2\t0\t16\tprimer_1.txt\t0\t-\tACGTAAttttTGAACC\n"
+        self.three_mismatches = "seq3\t0\t16\tprimer_1.txt\t0\t+\tACGTACttttACTACC\n"
+        self.bed.write_text(self.exact + self.one_mismatch + self.three_mismatches)
+        self.out_paths = {
+            i: Path(self.test_dir) / f"primer_1.txt_seqkit_amplicon_against_target_m{i}.txt" for i in range(3)
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_split_into_lower_levels(self):
+        levels = split_bed_by_mismatches(self.bed, "ACGTAC", "GGTTCA", self.out_paths)
+
+        self.assertEqual(levels, {0, 1, 2})
+        self.assertEqual(self.out_paths[0].read_text(), self.exact)
+        self.assertEqual(self.out_paths[1].read_text(), self.exact + self.one_mismatch)
+        self.assertEqual(self.out_paths[2].read_text(), self.exact + self.one_mismatch)
+
+    def test_matches_separate_runs_with_several_binding_sites(self):
+        frwd, rev = "ACGTACGGTC", "GATCCTTGCA"
+        rev_site = "TGCAAGGATC"  # reverse complement of the reverse primer
+
+        def mutate(site, positions):
+            return "".join(("A" if base != "A" else "C") if i in positions else base for i, base in enumerate(site))
+
+        # the forward primer binds three times (0, 1 and 3 mismatches), the reverse primer twice (0 and 2)
+        template = (
+            frwd + "T" * 15 + mutate(frwd, {4}) + "T" * 15 + mutate(frwd, {0, 5, 9}) + "T" * 15
+            + rev_site + "T" * 15 + mutate(rev_site, {2, 7}) + "T" * 15
+        )
+
+        def seqkit_amplicon(m):
+            # what a separate 'seqkit amplicon --bed -m m' run reports: every forward binding site with at most
+            # m mismatches together with every reverse binding site downstream of it with at most m mismatches
+            n = len(frwd)
+            windows = [(i, template[i:i + n]) for i in range(len(template) - n + 1)]
+            lines = []
+            for start, fwd_window in windows:
+                if sum(a != b for a, b in zip(frwd, fwd_window)) > m:
+                    continue
+                for end, rev_window in windows:
+                    if end >= start + n and sum(a != b for a, b in zip(rev_site, rev_window)) <= m:
+                        lines.append(f"seq1\t{start}\t{end + n}\tprimer_1.txt\t0\t+\t{template[start:end + n]}\n")
+            return "".join(lines)
+
+        self.bed.write_text(seqkit_amplicon(4))
+        out_paths = {
+            i: Path(self.test_dir) / f"primer_1.txt_seqkit_amplicon_against_neighbour_m{i}.txt" for i in range(4)
+        }
+
+        levels = split_bed_by_mismatches(self.bed, frwd, rev, out_paths)
+
+        self.assertEqual(levels, {0, 1, 2, 3})
+        for i, out_path in out_paths.items():
+            self.assertEqual(out_path.read_text(), seqkit_amplicon(i))
+        # several amplicons per level, not just the one of the best binding sites
+        self.assertEqual(out_paths[0].read_text().count("\n"), 1)
+        self.assertEqual(out_paths[2].read_text().count("\n"), 4)
+        self.assertEqual(out_paths[3].read_text().count("\n"), 6)
+
+    def test_no_lines_no_files(self):
+        self.bed.write_text(self.three_mismatches)
+
+        levels = split_bed_by_mismatches(self.bed, "ACGTAC", "GGTTCA", self.out_paths)
+
+        self.assertEqual(levels, set())
+        for out_path in self.out_paths.values():
+            self.assertFalse(out_path.exists())
+
+
+class test_get_max_workers(unittest.TestCase):
+
+    @patch("Primer_Testing_module_optimized.os.sysconf")
+    @patch("Primer_Testing_module_optimized.available_cpus", return_value=8)
+    def test_capped_by_jobs_and_cpus(self, mock_cpu_count, mock_sysconf):
+        # plenty of memory
+        mock_sysconf.return_value = 1024 * 1024
+        self.assertEqual(get_max_workers(4, 1000), 4)
+        self.assertEqual(get_max_workers(9, 1000), 8)
+
+    @patch("Primer_Testing_module_optimized.os.sysconf")
+    @patch("Primer_Testing_module_optimized.available_cpus", return_value=8)
+    def test_capped_by_memory(self, mock_cpu_count, mock_sysconf):
+        # 4 pages of 1000 bytes free, each worker needs twice the fasta size
+        mock_sysconf.side_effect = lambda name: {"SC_AVPHYS_PAGES": 4, "SC_PAGE_SIZE": 1000}[name]
+        self.assertEqual(get_max_workers(9, 1000), 2)
+        # never less than one worker
+        self.assertEqual(get_max_workers(9, 10**9), 1)
+
+    @patch("Primer_Testing_module_optimized.os.sysconf", side_effect=ValueError)
+    @patch("Primer_Testing_module_optimized.available_cpus", return_value=2)
+    def test_no_memory_info(self, mock_cpu_count, mock_sysconf):
+        self.assertEqual(get_max_workers(9, 1000), 2)
+
+
+class test_available_cpus(unittest.TestCase):
+
+    @patch("Primer_Testing_module_optimized.os.sched_getaffinity", return_value={0, 1}, create=True)
+    @patch("Primer_Testing_module_optimized.os.cpu_count", return_value=64)
+    def test_uses_affinity(self, mock_cpu_count, mock_affinity):
+        self.assertEqual(available_cpus(), 2)
+
+    @patch("Primer_Testing_module_optimized.os.sched_getaffinity", side_effect=AttributeError, create=True)
+    @patch("Primer_Testing_module_optimized.os.cpu_count", return_value=None)
+    def test_fallback_without_affinity(self, mock_cpu_count, mock_affinity):
+        self.assertEqual(available_cpus(), 1)
+
+
+class test_write_primer_table(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_one_line_per_primer_pair(self):
+        folder = Path(self.test_dir)
+        primer_pairs = {
+            ("ATCG", "CGTA"): [folder / "primer_1.txt", folder / "primer_3.txt"],
+            ("GGCC", "TTAA"): [folder / "primer_2.txt"],
+        }
+        table = write_primer_table(primer_pairs, folder / "primers.tsv")
+
+        # pairs are named after their first primer file
+        self.assertEqual(
+            table.read_text(), "primer_1.txt\tATCG\tCGTA\nprimer_2.txt\tGGCC\tTTAA\n"
+        )
 
        
 class TestRunSeqkitLocate(unittest.TestCase):
@@ -547,8 +911,9 @@ class TestRunSeqkitLocate(unittest.TestCase):
 
         # Mock subprocess.Popen to simulate successful seqkit output
         mock_process = MagicMock()
-        mock_process.communicate.return_value = ("seqkit output", "")  # Simulate output and no error
+        mock_process.communicate.return_value = (b"seqkit output", b"")  # Simulate output and no error
         mock_process.returncode = 0
+        mock_process.__enter__.return_value = mock_process
         mock_popen.return_value = mock_process
 
         # Test data
@@ -559,16 +924,15 @@ class TestRunSeqkitLocate(unittest.TestCase):
         result = run_seqkit_locate(amplicon, ref_file, mock_logger_instance)
 
         # Assert that the subprocess.Popen was called with the correct arguments
-        mock_popen.assert_called_with(
-            ["seqkit", "locate", "-p", amplicon, "--bed", "-m", "2"],
-            stdin=mock_process.stdout,
+        mock_popen.assert_called_once_with(
+            [_SEQKIT, "locate", "-p", amplicon, "--bed", "-m", "2", str(ref_file)],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
+            close_fds=False,
         )
 
         # Assert the result returned is the expected output
-        self.assertEqual(result, "seqkit output")
+        self.assertEqual(result, b"seqkit output")
 
         # Assert logger methods were called
         mock_logger_instance.info.assert_called_with(
@@ -585,8 +949,9 @@ class TestRunSeqkitLocate(unittest.TestCase):
 
         # Mock subprocess.Popen to simulate error in seqkit output
         mock_process = MagicMock()
-        mock_process.communicate.return_value = ("", "Error in seqkit")
+        mock_process.communicate.return_value = (b"", b"Error in seqkit")
         mock_process.returncode = 1  # Non-zero return code indicates an error
+        mock_process.__enter__.return_value = mock_process
         mock_popen.return_value = mock_process
 
         # Test data
@@ -598,12 +963,11 @@ class TestRunSeqkitLocate(unittest.TestCase):
             run_seqkit_locate(amplicon, ref_file, mock_logger_instance)
 
         # Assert that the subprocess was called with the correct arguments
-        mock_popen.assert_called_with(
-            ["seqkit", "locate", "-p", amplicon, "--bed", "-m", "2"],
-            stdin=mock_process.stdout,
+        mock_popen.assert_called_once_with(
+            [_SEQKIT, "locate", "-p", amplicon, "--bed", "-m", "2", str(ref_file)],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
+            close_fds=False,
         )
 
         # Assert the logger error method was called
@@ -614,5 +978,152 @@ class TestRunSeqkitLocate(unittest.TestCase):
 
 
         
+
+class test_batched_blastx(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        # Primer3 module gives all targets the same header
+        self.target1 = Path(self.test_dir) / "Target_1.txt"
+        self.target1.write_text(">SEQUENCE_TEMPLATE\nATGCGT\nTTA\n")
+        self.target2 = Path(self.test_dir) / "Target_2.txt"
+        self.target2.write_text(">SEQUENCE_TEMPLATE\nGGCCAA")
+        self.query = Path(self.test_dir) / "query.fasta"
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_write_blastx_query(self):
+        queries = write_blastx_query([self.target1, self.target2], self.query)
+
+        self.assertEqual(
+            self.query.read_bytes(), b">query_0\nATGCGT\nTTA\n>query_1\nGGCCAA\n"
+        )
+        self.assertEqual(
+            queries,
+            {
+                b"query_0": (self.target1, b"SEQUENCE_TEMPLATE"),
+                b"query_1": (self.target2, b"SEQUENCE_TEMPLATE"),
+            },
+        )
+
+    def test_split_blastx_output(self):
+        queries = {
+            b"query_0": (self.target1, b"SEQUENCE_TEMPLATE"),
+            b"query_1": (self.target2, b"SEQUENCE_TEMPLATE"),
+        }
+        output = b"query_1\tWP_1.1\t99.0\nquery_1\tWP_2.1\t98.0\n"
+
+        hits = split_blastx_output(output, queries)
+
+        # target 1 has no hits, the original id is restored
+        self.assertEqual(
+            hits, {self.target2: [b"SEQUENCE_TEMPLATE\tWP_1.1\t99.0\n", b"SEQUENCE_TEMPLATE\tWP_2.1\t98.0\n"]}
+        )
+
+    @patch("Primer_Testing_module_optimized._BLASTX_BATCH_SIZE", 1)
+    @patch("Primer_Testing_module_optimized.run_blastx")
+    def test_blastx_targets_in_batches(self, mock_run_blastx):
+        mock_logger = MagicMock()
+        # every batch has one target, so its only query is query_0
+        mock_run_blastx.return_value = b"query_0\tWP_1.1\n"
+
+        hits = blastx_targets([self.target1, self.target2], Path(self.test_dir), mock_logger)
+
+        self.assertEqual(mock_run_blastx.call_count, 2)
+        self.assertEqual(
+            hits,
+            {
+                self.target1: [b"SEQUENCE_TEMPLATE\tWP_1.1\n"],
+                self.target2: [b"SEQUENCE_TEMPLATE\tWP_1.1\n"],
+            },
+        )
+        # the query files are cleaned up
+        self.assertFalse(list(Path(self.test_dir).glob("targets_blastx_query_*")))
+
+    @patch("Primer_Testing_module_optimized.run_blastx")
+    def test_blastx_targets_identical_targets(self, mock_run_blastx):
+        mock_logger = MagicMock()
+        target3 = Path(self.test_dir) / "Target_3.txt"
+        target3.write_bytes(self.target1.read_bytes())
+        mock_run_blastx.return_value = b"query_0\tWP_1.1\n"
+
+        hits = blastx_targets([self.target1, self.target2, target3], Path(self.test_dir), mock_logger)
+
+        # target 3 is not sent to blastx, it gets the lines of target 1
+        mock_run_blastx.assert_called_once()
+        self.assertEqual(hits[target3], [b"SEQUENCE_TEMPLATE\tWP_1.1\n"])
+        self.assertEqual(hits[self.target1], hits[target3])
+        self.assertNotIn(self.target2, hits)
+
+    def test_has_blastx_hits(self):
+        # no result file yet
+        self.assertFalse(has_blastx_hits(self.target1))
+        # blastx found nothing, so it is run again
+        Path(f"{self.target1}_blastx_1e-5.txt").write_bytes(b"")
+        self.assertFalse(has_blastx_hits(self.target1))
+        Path(f"{self.target1}_blastx_1e-5.txt").write_bytes(b"SEQUENCE_TEMPLATE\tWP_1.1\n")
+        self.assertTrue(has_blastx_hits(self.target1))
+
+    def test_has_blastx_hits_target_newer_than_result(self):
+        result = Path(f"{self.target1}_blastx_1e-5.txt")
+        result.write_bytes(b"SEQUENCE_TEMPLATE\tWP_1.1\n")
+        # Primer3 wrote a new target with the same name after the blastx run, its old hits are stale
+        os.utime(result, (0, 0))
+        self.assertFalse(has_blastx_hits(self.target1))
+
+        mock_logger = MagicMock()
+        self.assertEqual(
+            select_targets_to_blast([self.target1, self.target2], False, mock_logger), [self.target1, self.target2]
+        )
+        mock_logger.info.assert_not_called()
+
+    def test_select_targets_to_blast(self):
+        mock_logger = MagicMock()
+        # target 1 has hits from an earlier run, target 2 got no hits
+        Path(f"{self.target1}_blastx_1e-5.txt").write_bytes(b"SEQUENCE_TEMPLATE\tWP_1.1\n")
+        Path(f"{self.target2}_blastx_1e-5.txt").write_bytes(b"")
+
+        self.assertEqual(select_targets_to_blast([self.target1, self.target2], False, mock_logger), [self.target2])
+        mock_logger.info.assert_called_once()
+        # the result of the earlier run is kept
+        self.assertEqual(Path(f"{self.target1}_blastx_1e-5.txt").read_bytes(), b"SEQUENCE_TEMPLATE\tWP_1.1\n")
+
+        # --overwrite blasts all targets again
+        self.assertEqual(
+            select_targets_to_blast([self.target1, self.target2], True, mock_logger), [self.target1, self.target2]
+        )
+
+    @patch("subprocess.run")
+    def test_run_blastx(self, mock_run):
+        mock_logger = MagicMock()
+        mock_run.return_value = MagicMock(stdout=b"query_0\tWP_1.1\n")
+
+        self.assertEqual(run_blastx(self.query, mock_logger), b"query_0\tWP_1.1\n")
+        self.assertEqual(mock_run.call_args[0][0][:3], ["blastx", "-query", str(self.query)])
+
+    @patch("subprocess.run")
+    def test_run_blastx_failure(self, mock_run):
+        mock_logger = MagicMock()
+        mock_run.side_effect = subprocess.CalledProcessError(1, "blastx", stderr=b"no connection")
+
+        with self.assertRaises(RuntimeError):
+            run_blastx(self.query, mock_logger)
+        mock_logger.exception.assert_called_once()
+
+
+class test_main_arguments(unittest.TestCase):
+
+    @patch("sys.argv", ["Primer_Testing_module_optimized.py", "--help"])
+    def test_parser_builds(self):
+        # conflicting option strings would raise an argparse.ArgumentError before the help is printed
+        help_text = io.StringIO()
+        with redirect_stdout(help_text), self.assertRaises(SystemExit) as cm:
+            main()
+        self.assertEqual(cm.exception.code, 0)
+        self.assertIn("-o OUTFILE_PREFIX", help_text.getvalue())
+        self.assertIn("-O, --overwrite", help_text.getvalue())
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -5,7 +5,6 @@ from pathlib import Path
 import tempfile
 import shutil
 import subprocess
-import pandas as pd
 from unittest.mock import patch,MagicMock
 from logging_handler import Logger
 
@@ -13,7 +12,8 @@ from logging_handler import Logger
 from Summarize_results_module_improved import ( is_tool, count_files, check_folders,
                          extract_number_and_primers, extract_number_from_filename,
                          extract_primer_sequences, get_amplicon_length_from_seq,
-                         run_tests, handle_blasts_and_efetch, get_highest_scoring_accession,
+                         run_tests, list_in_silico_files, handle_blasts_and_efetch,
+                         best_blastx_hits, fetch_titles, get_highest_scoring_accession,
                          interpret_and_reformat_sensi_speci_tests)
 
 class TestPrimerScript(unittest.TestCase):
@@ -114,18 +114,39 @@ class TestPrimerScript(unittest.TestCase):
         ampli_len = get_amplicon_length_from_seq(self.seqkit_file)
         self.assertEqual(ampli_len, 7)
 
-    @patch('Summarize_results_module_improved.pd.read_csv')
-    def test_get_highest_scoring_accession(self, mock_read_csv):
-        mock_read_csv.return_value = pd.DataFrame({
-            'sseqid': ['acc1', 'acc2'],
-            'evalue': [0.01, 0.02],
-            'bitscore': [50.0, 40.0]
-        })
-        sseqid, evalue, bitscore = get_highest_scoring_accession(self.seqkit_file)
+    def test_get_highest_scoring_accession(self):
+        blastx_file = Path(self.test_dir) / "Target_1.txt_blastx_1e-5.txt"
+        blastx_file.write_text(
+            "# BLASTX\n"
+            "SEQUENCE_TEMPLATE\tacc2\t90.0\t50\t5\t0\t1\t150\t1\t50\t0.02\t40.0\n"
+            "SEQUENCE_TEMPLATE\tacc1\t95.0\t50\t2\t0\t1\t150\t1\t50\t0.01\t50.0\n"
+            "SEQUENCE_TEMPLATE\tacc3\t95.0\t50\t2\t0\t1\t150\t1\t50\t0.03\t50.0\n"
+        )
+        # the first row with the highest bitscore wins
+        sseqid, evalue, bitscore = get_highest_scoring_accession(blastx_file)
         self.assertEqual(sseqid, 'acc1')
         self.assertEqual(evalue, 0.01)
         self.assertEqual(bitscore, 50.0)
 
+    def test_get_highest_scoring_accession_integer_bitscores(self):
+        blastx_file = Path(self.test_dir) / "Target_1.txt_blastx_1e-5.txt"
+        blastx_file.write_text(
+            "SEQUENCE_TEMPLATE\tacc1\t95.0\t50\t2\t0\t1\t150\t1\t50\t1e-50\t998\n"
+            "SEQUENCE_TEMPLATE\tacc2\t99.0\t50\t0\t0\t1\t150\t1\t50\t0.0\t2071\n"
+        )
+        sseqid, evalue, bitscore = get_highest_scoring_accession(blastx_file)
+        self.assertEqual(sseqid, 'acc2')
+        self.assertEqual(evalue, 0.0)
+        # reported as in the file, not as 2071.0
+        self.assertEqual(f"{bitscore}", "2071")
+
+    def test_get_highest_scoring_accession_no_hits(self):
+        blastx_file = Path(self.test_dir) / "Target_1.txt_blastx_1e-5.txt"
+        blastx_file.write_text("# BLASTX\n")
+        self.assertEqual(
+            get_highest_scoring_accession(blastx_file), ("Blast did not find hits", float("inf"), 0)
+        )
+
 class TestHandleBlastsAndEfetch(unittest.TestCase):
 
     @patch('Summarize_results_module_improved.Logger')
@@ -315,6 +336,72 @@ class TestHandleBlastsAndEfetch(unittest.TestCase):
         self.assertEqual(result, expected_result)
         mock_popen.assert_not_called()  # Check that subprocess.Popen was not called
 
+    @patch('Summarize_results_module_improved.get_highest_scoring_accession')
+    @patch('Summarize_results_module_improved.Path.glob')
+    @patch('Summarize_results_module_improved.Path.stat')
+    @patch('Summarize_results_module_improved.is_tool')
+    @patch('Summarize_results_module_improved.subprocess.Popen')
+    def test_title_already_fetched(self, mock_popen, mock_is_tool, mock_stat, mock_glob, mock_get_highest_scoring_accession):
+        mock_logger_instance = MagicMock()
+        mock_is_tool.return_value = True
+        mock_glob.return_value = [MagicMock()]
+        mock_stat.return_value.st_size = 100
+        mock_get_highest_scoring_accession.return_value = ("acc123", 1e-5, 50)
+
+        result = handle_blasts_and_efetch(Path('/some/folder'), 1, mock_logger_instance, {"acc123": "Mock Title"})
+
+        expected_result = (
+            "The primer 1's target with the highest bitscore 50 & evalue 1.00e-05 has the accession acc123 and codes for Mock Title. \nFurther information on the accession: https://www.ncbi.nlm.nih.gov/protein/acc123/ \n"
+        )
+        self.assertEqual(result, expected_result)
+        mock_popen.assert_not_called()
+
+
+class TestFetchTitles(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_best_blastx_hits(self):
+        folder = Path(self.test_dir)
+        primers = [folder / f"Primer_{i}.txt" for i in (1, 2, 3, 4)]
+        for primer in primers:
+            primer.write_text("PRIMER_LEFT\nATCG\n")
+        row = "SEQUENCE_TEMPLATE\t{}\t95.0\t50\t2\t0\t1\t150\t1\t50\t0.01\t50.0\n"
+        (folder / "Target_1.txt_blastx_1e-5.txt").write_text(row.format("acc2"))
+        (folder / "Target_2.txt_blastx_1e-5.txt").write_text(row.format("acc1"))
+        (folder / "Target_3.txt_blastx_1e-5.txt").write_text(row.format("acc1"))
+        # primer 4 has no blastx hits
+        (folder / "Target_4.txt_blastx_1e-5.txt").write_text("")
+
+        self.assertEqual(best_blastx_hits(primers, folder, MagicMock()), ["acc1", "acc2"])
+
+    @patch('Summarize_results_module_improved.is_tool')
+    @patch('Summarize_results_module_improved.subprocess.Popen')
+    def test_fetch_titles(self, mock_popen, mock_is_tool):
+        mock_is_tool.return_value = True
+        mock_efetch_popen = MagicMock()
+        mock_xtract_popen = MagicMock()
+        mock_popen.side_effect = [mock_efetch_popen, mock_xtract_popen]
+        mock_xtract_popen.communicate.return_value = ("acc1\tTitle one\nWP_2.1\tTitle two\n", None)
+
+        titles = fetch_titles(["acc1", "ref|WP_2.1|", "acc3"], MagicMock())
+
+        # one request for all ids, acc3 has no title
+        self.assertEqual(mock_popen.call_args_list[0][0][0][4], "acc1,ref|WP_2.1|,acc3")
+        self.assertEqual(titles, {"acc1": "Title one", "ref|WP_2.1|": "Title two"})
+
+    @patch('Summarize_results_module_improved.is_tool')
+    @patch('Summarize_results_module_improved.subprocess.Popen')
+    def test_fetch_titles_without_efetch(self, mock_popen, mock_is_tool):
+        mock_is_tool.return_value = False
+
+        self.assertEqual(fetch_titles(["acc1"], MagicMock()), {})
+        mock_popen.assert_not_called()
+
 
 class TestRunTests(unittest.TestCase):
     maxDiff = None
@@ -477,6 +564,29 @@ class TestRunTests(unittest.TestCase):
         # Assert the expected output
         self.assertEqual(result, expected_dict)
     
+    def test_list_in_silico_files(self):
+        files = list_in_silico_files(Path(self.test_dir), "Test_Primer_123.txt")
+
+        self.assertEqual(
+            sorted(doc.name for doc in files["target"]),
+            [f"Test_Primer_123.txt_seqkit_amplicon_against_target_m{i}.txt" for i in (0, 1, 3)],
+        )
+        self.assertEqual(
+            [doc.name for doc in files["neighbour"]],
+            ["Test_Primer_123.txt_seqkit_amplicon_against_neighbour_m0.txt"],
+        )
+
+    def test_run_tests_with_listed_files(self):
+        mock_logger_instance = MagicMock()
+        files = list_in_silico_files(Path(self.test_dir), "Test_Primer_123.txt")
+
+        with patch('Summarize_results_module_improved.Path.glob') as mock_glob:
+            result = run_tests(Path(self.test_dir), "Test_Primer_123.txt", 6, 4, "neighbour", mock_logger_instance, files["neighbour"])
+
+        # the listed files are used, the folder is not searched again
+        mock_glob.assert_not_called()
+        self.assertEqual(result["Number of files that passed:"], 1)
+
 class TestInterpretAndReformatSensiSpeciTests(unittest.TestCase):
 
     @patch('Summarize_results_module_improved.Logger')